@@ -0,0 +1,240 @@
+"""
+Measures the crawlers without the live site. Recorded info and reader pages from
+benchmarks/fixtures are served by a local stand-in server that adds a fixed latency to
+every response, then InfoPageSpider is run through run_spider and reader pages through
+crawl_issues.
+
+Usage:
+    python -m benchmarks.crawl --info-pages 200 --issues 100 --latency 0.05
+
+Reported:
+    process overhead: the first crawl of one page (which starts the crawler process)
+        minus a warm crawl of one page
+    pages/s: info pages or issues crawled per second
+    item latency: for info pages, from the server receiving a request to its item
+        reaching the caller, for issues the average crawl time of each crawl path
+
+Lazy loaded reader pages need the browser pool, so they're only crawled with
+--lazy-issues. With --min-info-pages-per-second / --min-issues-per-second the exit code
+is 1 when a run is slower, to catch regressions in CI.
+"""
+
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+import statistics
+import contextlib
+import threading
+import tempfile
+import argparse
+import json
+import time
+import sys
+import os
+
+# Cached info pages would skip the requests being measured, crawl into a throwaway cache
+os.environ["CRAWL_CACHE_DIR"] = tempfile.mkdtemp(prefix="crawl-benchmark-")
+
+from crawlers.rcoli import (
+    stream_spider,
+    InfoPageSpider,
+    crawl_issues,
+    crawl_stats,
+)
+
+FIXTURES_FOLDER = Path(__file__).parent / "fixtures"
+
+# 1x1 transparent gif, served for every image
+GIF = bytes.fromhex(
+    "47494638396101000100800000000000ffffff21f90401000000002c000000000100010000020144003b"
+)
+
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the fixtures in place of the site:
+        /Comic/<name>                   info_page.html
+        /Comic/<name>/<issue>           reader_page.html, or reader_page_lazy.html with lazy=1
+        *.gif, *.jpg                    a 1x1 gif
+    """
+
+    latency = 0
+    # Time every path was requested at, to measure item latency
+    requested_at = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.requested_at[self.path] = time.perf_counter()
+        time.sleep(self.latency)
+
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+
+        if url.path.endswith((".gif", ".jpg")):
+            self.send_body(GIF, "image/gif")
+        elif len(parts) == 2 and parts[0] == "Comic":
+            self.send_fixture("info_page.html")
+        elif len(parts) == 3 and parts[0] == "Comic":
+            lazy = "lazy=1" in url.query
+            self.send_fixture("reader_page_lazy.html" if lazy else "reader_page.html")
+        else:
+            self.send_error(404)
+
+    def send_fixture(self, name):
+        self.send_body((FIXTURES_FOLDER / name).read_bytes(), "text/html")
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stand_in_server(latency):
+    handler = type(
+        "Handler", (StandInHandler,), {"latency": latency, "requested_at": {}}
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, handler
+
+
+def summarize_latencies(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"mean": None, "p95": None}
+
+    return {
+        "mean": statistics.mean(latencies),
+        "p95": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+def benchmark_info_pages(base_url, handler, count):
+    def crawl(urls):
+        start_time = time.perf_counter()
+        latencies = []
+
+        for item in stream_spider(urls, InfoPageSpider):
+            path = item["link"][len(base_url) :]
+            latencies.append(time.perf_counter() - handler.requested_at[path])
+
+        return time.perf_counter() - start_time, latencies
+
+    # The first crawl starts the crawler process, the same crawl again is warm
+    cold_seconds, _ = crawl([f"{base_url}/Comic/Overhead-Cold"])
+    warm_seconds, _ = crawl([f"{base_url}/Comic/Overhead-Warm"])
+
+    urls = [f"{base_url}/Comic/Example-Comic-{index}" for index in range(count)]
+    seconds, latencies = crawl(urls)
+
+    return {
+        "process_overhead_seconds": cold_seconds - warm_seconds,
+        "pages": len(latencies),
+        "seconds": seconds,
+        "pages_per_second": len(latencies) / seconds,
+        "item_latency": summarize_latencies(latencies),
+    }
+
+
+def benchmark_issues(base_url, count, lazy_count):
+    workload = [
+        {
+            "issue_id": index,
+            "link": f"{base_url}/Comic/Example-Comic/Issue-{index}?id={index}"
+            "&s=&readType=1",
+        }
+        for index in range(count)
+    ] + [
+        {
+            "issue_id": count + index,
+            "link": f"{base_url}/Comic/Example-Comic/Lazy-{index}?id={index}"
+            "&s=&readType=1&lazy=1",
+        }
+        for index in range(lazy_count)
+    ]
+
+    start_time = time.perf_counter()
+    successes, failures = crawl_issues(workload)
+    seconds = time.perf_counter() - start_time
+
+    return {
+        "issues": len(workload),
+        "failures": len(failures),
+        "seconds": seconds,
+        "issues_per_second": len(successes) / seconds,
+        "crawl_paths": crawl_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--info-pages", type=int, default=100)
+    parser.add_argument("--issues", type=int, default=50)
+    parser.add_argument("--lazy-issues", type=int, default=0)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds added to every response"
+    )
+    parser.add_argument("--min-info-pages-per-second", type=float)
+    parser.add_argument("--min-issues-per-second", type=float)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    server, handler = start_stand_in_server(args.latency)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    # The crawlers print as they go, keep stdout for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        results = {
+            "info_pages": benchmark_info_pages(base_url, handler, args.info_pages),
+            "issues": benchmark_issues(base_url, args.issues, args.lazy_issues),
+        }
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        info_pages = results["info_pages"]
+        print(
+            f"info pages: {info_pages['pages']} in {info_pages['seconds']:.2f}s, "
+            f"{info_pages['pages_per_second']:.1f} pages/s, "
+            f"item latency mean {info_pages['item_latency']['mean']:.3f}s "
+            f"p95 {info_pages['item_latency']['p95']:.3f}s, "
+            f"process overhead {info_pages['process_overhead_seconds']:.2f}s"
+        )
+        issues = results["issues"]
+        print(
+            f"issues: {issues['issues']} in {issues['seconds']:.2f}s "
+            f"({issues['failures']} failed), "
+            f"{issues['issues_per_second']:.1f} issues/s"
+        )
+        for path, stats in issues["crawl_paths"].items():
+            if stats["attempts"]:
+                print(
+                    f"    {path}: {stats['attempts']} attempts, "
+                    f"{stats['success_rate']:.0%} succeeded, "
+                    f"{stats['average_seconds']:.3f}s average"
+                )
+
+    too_slow = []
+    if (
+        args.min_info_pages_per_second is not None
+        and results["info_pages"]["pages_per_second"] < args.min_info_pages_per_second
+    ):
+        too_slow.append("info pages")
+    if (
+        args.min_issues_per_second is not None
+        and results["issues"]["issues_per_second"] < args.min_issues_per_second
+    ):
+        too_slow.append("issues")
+
+    if too_slow:
+        print("Slower than the minimum: " + ", ".join(too_slow), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compares image download throughput of one requests.get per image (the old behavior)
+against the shared keep-alive session used by the downloader.
+
+Usage:
+    python -m benchmarks.download_session urls.txt --threads 8 --rounds 3
+
+urls.txt contains one image link per line, for example exported from the Page table.
+Nothing is written to disk, the responses are read and discarded.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from comics.http_session import create_session, DOWNLOAD_TIMEOUT
+import argparse
+import requests
+import time
+
+
+def fetch_without_session(link):
+    with requests.get(link, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        return sum(len(chunk) for chunk in response.iter_content(64 * 1024))
+
+
+def run(links, fetch, threads):
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        total_bytes = sum(executor.map(fetch, links))
+
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "seconds": elapsed,
+        "images_per_second": len(links) / elapsed,
+        "mb_per_second": total_bytes / elapsed / 1024 / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("urls_file")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.urls_file) as file:
+        links = [line.strip() for line in file if line.strip()]
+
+    session = create_session(pool_size=args.threads)
+
+    def fetch_with_session(link):
+        with session.get(link, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            return sum(len(chunk) for chunk in response.iter_content(64 * 1024))
+
+    for name, fetch in (
+        ("requests.get per image", fetch_without_session),
+        ("shared session", fetch_with_session),
+    ):
+        for round_number in range(args.rounds):
+            result = run(links, fetch, args.threads)
+            print(
+                f"{name} round {round_number + 1}: {result['seconds']:.2f}s, "
+                f"{result['images_per_second']:.1f} images/s, "
+                f"{result['mb_per_second']:.2f} MB/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Compares the old row by row ingestion against the bulk ingestion in rcoli.ingest, in
+rows written per second: creating a crawled series with its issues, and replacing the
+pages of a crawled issue.
+
+Usage:
+    python -m benchmarks.ingest --issues 1000 --pages 5000 --rounds 3
+
+Runs against the database in the project settings. Each round writes in autocommit mode,
+like the API does, and deletes its comic afterwards.
+"""
+
+import argparse
+import django
+import time
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cbdlapi.settings")
+os.environ.setdefault("RCOLI_BASE_LINK", "https://benchmark.invalid")
+django.setup()
+
+from comics.models import Comic, Issue, Page
+from comics.utils import create_date
+from rcoli.ingest import add_comic_from_crawl, replace_issue_pages
+
+
+def crawled_item(name, issue_count):
+    return {
+        "title": name,
+        "link": f"https://benchmark.invalid/Comic/{name}",
+        "writers": "Writer",
+        "artists": "Artist",
+        "date_published": "2011",
+        "status": "Ongoing",
+        "content_hash": "",
+        "issues": [
+            {
+                "issue_title": f"{name} Issue #{number}",
+                "issue_link": f"/Comic/{name}/Issue-{number}?id={number}",
+            }
+            for number in range(1, issue_count + 1)
+        ],
+    }
+
+
+def ingest_one_by_one(item):
+    comic = Comic.objects.create(
+        title=item["title"],
+        link=item["link"],
+        date_published=create_date(item["date_published"]),
+        writers=item["writers"],
+        artists=item["artists"],
+        number_issues=len(item["issues"]),
+    )
+
+    for issue in item["issues"]:
+        Issue.objects.create(
+            title=issue["issue_title"],
+            link=os.getenv("RCOLI_BASE_LINK") + issue["issue_link"],
+            comic_id=comic,
+            pages=0,
+        )
+
+
+def crawled_pages(name, page_count):
+    return [
+        {"page": number, "link": f"https://benchmark.invalid/{name}/{number}.jpg"}
+        for number in range(1, page_count + 1)
+    ]
+
+
+def replace_pages_one_by_one(issue, pages):
+    Page.objects.filter(issue_id=issue).delete()
+
+    for page in pages:
+        Page.objects.create(
+            issue_id=issue,
+            page_number=page["page"],
+            title=issue.title,
+            image_link=page["link"],
+        )
+
+    issue.pages = len(pages)
+    issue.save()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--issues", type=int, default=1000)
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    for name, ingest in (
+        ("create per issue", ingest_one_by_one),
+        ("bulk", add_comic_from_crawl),
+    ):
+        for round_number in range(args.rounds):
+            item = crawled_item(f"Benchmark-{round_number}", args.issues)
+
+            try:
+                start_time = time.perf_counter()
+                ingest(item)
+                elapsed = time.perf_counter() - start_time
+            finally:
+                Comic.objects.filter(link=item["link"]).delete()
+
+            print(
+                f"{name} round {round_number + 1}: {elapsed:.3f}s, "
+                f"{args.issues / elapsed:.0f} issues/s"
+            )
+
+    item = crawled_item("Benchmark-Pages", 1)
+    add_comic_from_crawl(item)
+    issue = Issue.objects.get(comic_id__link=item["link"])
+
+    try:
+        for name, replace in (
+            ("create per page", replace_pages_one_by_one),
+            ("bulk", replace_issue_pages),
+        ):
+            for round_number in range(args.rounds):
+                # Every round replaces the pages of the round before
+                pages = crawled_pages(f"{name}-{round_number}", args.pages)
+
+                start_time = time.perf_counter()
+                replace(issue, pages)
+                elapsed = time.perf_counter() - start_time
+
+                print(
+                    f"{name} round {round_number + 1}: {elapsed:.3f}s, "
+                    f"{args.pages / elapsed:.0f} pages/s"
+                )
+    finally:
+        Comic.objects.filter(link=item["link"]).delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Compares the time to read the image srcs out of a reader page's HTML with BeautifulSoup's
+html.parser (the old behavior), BeautifulSoup with lxml, and the parsel extraction used by
+the crawler.
+
+Usage:
+    python -m benchmarks.parse_reader_pages page.html other_page.html --rounds 200
+
+Without files, the recorded reader pages in benchmarks/fixtures are used. The browser
+path no longer parses HTML at all, the srcs are read with READ_IMAGE_SOURCES_SCRIPT.
+"""
+
+from bs4 import BeautifulSoup
+from crawlers.rcoli import image_sources_from_html
+from pathlib import Path
+import argparse
+import time
+
+FIXTURES_FOLDER = Path(__file__).parent / "fixtures"
+
+
+def beautifulsoup_sources(html, features):
+    soup = BeautifulSoup(html, features)
+    return [img.get("src") for img in soup.find_all("img", attrs={"rel": "noreferrer"})]
+
+
+PARSERS = (
+    (
+        "BeautifulSoup html.parser",
+        lambda html: beautifulsoup_sources(html, "html.parser"),
+    ),
+    ("BeautifulSoup lxml", lambda html: beautifulsoup_sources(html, "lxml")),
+    ("parsel", image_sources_from_html),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("html_files", nargs="*")
+    parser.add_argument("--rounds", type=int, default=100)
+    args = parser.parse_args()
+
+    paths = [Path(path) for path in args.html_files] or sorted(
+        FIXTURES_FOLDER.glob("reader_*.html")
+    )
+    pages = [path.read_text(encoding="utf-8") for path in paths]
+
+    expected = [beautifulsoup_sources(html, "html.parser") for html in pages]
+
+    for name, parse in PARSERS:
+        if [parse(html) for html in pages] != expected:
+            print(f"{name}: found different srcs than html.parser")
+            continue
+
+        start_time = time.perf_counter()
+        for _ in range(args.rounds):
+            for html in pages:
+                parse(html)
+        elapsed = time.perf_counter() - start_time
+
+        per_page = elapsed / (args.rounds * len(pages))
+        print(f"{name}: {per_page * 1000:.2f} ms per page")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+from typing import List
+from dotenv import load_dotenv
+from comics.models import DownloadJob, DownloadJobStep
+from comics.http_session import DOWNLOAD_POOL_SIZE, DOWNLOAD_TIMEOUT
+from comics.progress import ProgressAggregator
+from comics.concurrency import AdaptiveLimiter, is_throttled_status
+from asgiref.sync import sync_to_async
+from comics.downloader import (
+    image_path,
+    fetch_from_cache,
+    store_in_cache,
+    partial_size,
+    range_headers,
+    read_validator,
+    save_validator,
+    remove_validator,
+    write_mode,
+    save_settled_concurrency,
+)
+import threading
+import asyncio
+import aiohttp
+import time
+import os
+
+load_dotenv()
+
+# Default number of concurrent downloads for jobs using the async engine
+ASYNC_DOWNLOAD_CONCURRENCY = int(os.getenv("ASYNC_DOWNLOAD_CONCURRENCY", 100))
+
+# Size of the chunks read from a response, at most one chunk per download is in memory
+CHUNK_SIZE = 64 * 1024
+
+
+def download_images_async(
+    job: DownloadJob, steps: List[DownloadJobStep], concurrency=None
+):
+    """
+    Downloads the images for the given steps on an asyncio event loop in the calling
+    thread. Works like download_images but can keep hundreds of downloads in flight
+    without a thread per download. The concurrency is taken from concurrency, then
+    job.threads, then the ASYNC_DOWNLOAD_CONCURRENCY default.
+
+    Returns:
+        A dictionary mapping each step id to "complete", "failed" or "cancelled".
+    """
+    # Evaluate querysets here, the ORM can't be used directly from the event loop
+    steps = list(steps)
+
+    if not steps:
+        print("No images to download.")
+        return {}
+
+    concurrency = concurrency or job.threads or ASYNC_DOWNLOAD_CONCURRENCY
+
+    # Set by the progress aggregator once the job's cancel_requested is seen
+    cancel_event = threading.Event()
+
+    with ProgressAggregator(job, cancel_event) as progress:
+        return asyncio.run(
+            _download_all(job, steps, concurrency, cancel_event, progress)
+        )
+
+
+async def _download_all(job, steps, concurrency, cancel_event, progress):
+    results = {}
+
+    # Adaptive jobs start at concurrency and let the limiter decide how many run at once
+    limiter = None
+    if job.adaptive:
+        limiter = AdaptiveLimiter(
+            concurrency, maximum=max(concurrency, ASYNC_DOWNLOAD_CONCURRENCY)
+        )
+        concurrency = limiter.maximum
+    slots = asyncio.Condition()
+
+    queue = asyncio.Queue()
+    for step in steps:
+        queue.put_nowait(step)
+
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=DOWNLOAD_TIMEOUT[0], sock_read=DOWNLOAD_TIMEOUT[1]
+    )
+    connector = aiohttp.TCPConnector(
+        limit=concurrency, limit_per_host=max(concurrency, DOWNLOAD_POOL_SIZE)
+    )
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+
+        async def worker():
+            while not queue.empty():
+                step = queue.get_nowait()
+
+                if limiter:
+                    async with slots:
+                        await slots.wait_for(limiter.try_acquire)
+
+                try:
+                    # Steps that were still queued when the job got cancelled are skipped
+                    if cancel_event.is_set():
+                        results[step.id] = "cancelled"
+                        continue
+
+                    complete = await download_image_async(
+                        session, job, step, progress, limiter
+                    )
+                    results[step.id] = "complete" if complete else "failed"
+                except Exception as e:
+                    print(f"Unexpected error downloading step {step.id}: {e}")
+                    results[step.id] = "failed"
+                finally:
+                    if limiter:
+                        limiter.release()
+                        # The limit may have grown as well, wake every waiting worker
+                        async with slots:
+                            slots.notify_all()
+
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(steps)))))
+
+    if limiter:
+        await sync_to_async(save_settled_concurrency)(job, limiter)
+
+    return results
+
+
+async def download_image_async(
+    session: aiohttp.ClientSession,
+    job: DownloadJob,
+    download_job_step: DownloadJobStep,
+    progress: ProgressAggregator,
+    limiter: AdaptiveLimiter = None,
+):
+    save_path = image_path(job, download_job_step)
+    part_path = save_path + ".part"
+
+    # The cache uses the ORM, which can't be called from the event loop directly
+    if await sync_to_async(fetch_from_cache)(download_job_step, save_path, progress):
+        progress.step_complete(download_job_step)
+        return True
+
+    # Continue from what an earlier attempt left in the .part file
+    offset = partial_size(part_path)
+    validator = read_validator(part_path)
+
+    start_time = time.perf_counter()
+
+    try:
+        async with session.get(
+            download_job_step.image_link, headers=range_headers(offset, validator)
+        ) as response:
+            response.raise_for_status()
+
+            if limiter:
+                limiter.record_success(time.perf_counter() - start_time)
+
+            mode = write_mode(response.status, response.headers, offset)
+            if mode is None:
+                raise aiohttp.ClientError(
+                    f"Unexpected Content-Range: {response.headers.get('Content-Range')}"
+                )
+
+            if mode == "wb":
+                save_validator(part_path, response.headers)
+
+            with open(part_path, mode) as file:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    file.write(chunk)
+
+        # Only complete images ever have the .png name
+        os.replace(part_path, save_path)
+        remove_validator(part_path)
+        await sync_to_async(store_in_cache)(download_job_step, save_path)
+
+        # Only recorded in memory, the aggregator writes it from its own thread
+        progress.step_complete(download_job_step)
+        return True
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        status_code = getattr(e, "status", None)
+
+        if limiter and (
+            isinstance(e, (asyncio.TimeoutError, aiohttp.ClientConnectionError))
+            or (status_code and is_throttled_status(status_code))
+        ):
+            limiter.record_throttled()
+
+        if offset and status_code == 416:
+            # The .part file doesn't match the image anymore, start over next time
+            os.remove(part_path)
+            remove_validator(part_path)
+
+        progress.step_failed(download_job_step)
+        return False
@@ -0,0 +1,101 @@
+from dotenv import load_dotenv
+import threading
+import time
+import os
+
+load_dotenv()
+
+# Bounds for the number of concurrent downloads of an adaptive job
+ADAPTIVE_MIN_CONCURRENCY = int(os.getenv("ADAPTIVE_MIN_CONCURRENCY", 1))
+ADAPTIVE_MAX_CONCURRENCY = int(os.getenv("ADAPTIVE_MAX_CONCURRENCY", 16))
+
+# A response slower than this multiple of the usual latency stops the limit growing
+ADAPTIVE_SLOW_FACTOR = float(os.getenv("ADAPTIVE_SLOW_FACTOR", 2))
+
+# Seconds after a decrease in which further failures don't decrease the limit again,
+# requests that were already in flight would otherwise halve it several times
+ADAPTIVE_DECREASE_COOLDOWN = float(os.getenv("ADAPTIVE_DECREASE_COOLDOWN", 2))
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of concurrent downloads with additive increase / multiplicative
+    decrease. The limit grows by one after a full limit's worth of healthy responses
+    and is halved when the host throttles (429, 5xx or timeouts).
+
+    Threads wait for a slot with acquire(), the async engine uses try_acquire().
+    """
+
+    def __init__(
+        self,
+        initial,
+        minimum=ADAPTIVE_MIN_CONCURRENCY,
+        maximum=ADAPTIVE_MAX_CONCURRENCY,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+
+        self._in_flight = 0
+        self._healthy_responses = 0
+        self._usual_latency = None
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+
+    def try_acquire(self):
+        with self._condition:
+            if self._in_flight >= self.limit:
+                return False
+
+            self._in_flight += 1
+            return True
+
+    def acquire(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def record_success(self, latency):
+        """
+        Records the time until a successful response's headers arrived.
+        """
+        with self._condition:
+            if self._usual_latency is None:
+                self._usual_latency = latency
+
+            if latency > self._usual_latency * ADAPTIVE_SLOW_FACTOR:
+                # The host is slowing down, hold the limit where it is
+                self._healthy_responses = 0
+                return
+
+            # Moving average of healthy latencies
+            self._usual_latency = 0.8 * self._usual_latency + 0.2 * latency
+            self._healthy_responses += 1
+
+            if self._healthy_responses >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._healthy_responses = 0
+                self._condition.notify()
+
+    def record_throttled(self):
+        """
+        Records a 429, 5xx or timeout.
+        """
+        with self._condition:
+            self._healthy_responses = 0
+
+            now = time.monotonic()
+            if now - self._last_decrease < ADAPTIVE_DECREASE_COOLDOWN:
+                return
+
+            self.limit = max(self.minimum, self.limit // 2)
+            self._last_decrease = now
+
+
+def is_throttled_status(status_code):
+    return status_code == 429 or status_code >= 500
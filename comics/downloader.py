@@ -1,10 +1,18 @@
 from typing import List
 from dotenv import load_dotenv
-from comics.models import DownloadJob, DownloadJobStep
+from comics.models import DownloadJob, DownloadJobStep, Issue
 from comics.utils import sanitize_filename
+from comics.progress import ProgressAggregator
+from comics.concurrency import AdaptiveLimiter, is_throttled_status
+from comics import image_cache
+from comics.http_session import get_session, DOWNLOAD_TIMEOUT
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 import shutil
 import img2pdf
+import pikepdf
+import zipfile
+import time
 
 import requests
 import os
@@ -13,6 +21,26 @@ load_dotenv()
 
 DOWNLOAD_BASE_FOLDER = os.getenv("DOWNLOAD_FOLDER")
 
+# Default number of concurrent image downloads, a job can override it with job.threads
+DOWNLOAD_THREADS = int(os.getenv("DOWNLOAD_THREADS", 4))
+# Most concurrent downloads a job may ask for with job.threads, with either engine
+DOWNLOAD_MAX_THREADS = int(os.getenv("DOWNLOAD_MAX_THREADS", 256))
+
+# Jobs with more image bytes than this are combined into several PDFs, 0 disables it
+COMBINE_MAX_VOLUME_BYTES = int(os.getenv("COMBINE_MAX_VOLUME_BYTES", 0))
+
+# Engines a job can be downloaded with, see run_download
+DOWNLOAD_ENGINES = ("threaded", "async")
+
+# Formats a job can be combined into, see package
+OUTPUT_FORMATS = ("pdf", "cbz", "cbz_issues")
+
+# Seconds between RSS samples while a job is combined
+COMBINE_RSS_SAMPLE_INTERVAL = float(os.getenv("COMBINE_RSS_SAMPLE_INTERVAL", 0.05))
+
+# Most issue PDFs open at once while joining them, larger jobs are joined in rounds
+COMBINE_MERGE_CHUNK_SIZE = int(os.getenv("COMBINE_MERGE_CHUNK_SIZE", 64))
+
 
 def create_folders(job: DownloadJob):
     os.makedirs(f"{DOWNLOAD_BASE_FOLDER}\\{job.id}", exist_ok=True)
@@ -21,56 +49,267 @@ def create_folders(job: DownloadJob):
         os.makedirs(f"{DOWNLOAD_BASE_FOLDER}\\{job.id}\\{issue_index}", exist_ok=True)
 
 
-def download_images(job: DownloadJob, steps: List[DownloadJobStep], threads=4):
+def image_path(job: DownloadJob, step: DownloadJobStep):
+    return f"{DOWNLOAD_BASE_FOLDER}\\{job.id}\\{step.issue_index_number}\\{step.page_number}.png"
+
+
+def run_download(job: DownloadJob, steps: List[DownloadJobStep]):
+    """
+    Downloads the steps with the engine selected for the job (job.engine).
+    """
+    if job.engine == "async":
+        # Imported here because the async engine reuses helpers from this module
+        from comics.async_downloader import download_images_async
+
+        return download_images_async(job, steps)
+
+    return download_images(job, steps)
+
+
+def download_images(job: DownloadJob, steps: List[DownloadJobStep], threads=None):
+    """
+    Downloads the images for the given steps using a fixed size pool of worker threads.
+    A new download starts as soon as any worker is free. The pool size is taken from
+    threads, then job.threads, then the DOWNLOAD_THREADS default.
+
+    Returns:
+        A dictionary mapping each step id to "complete", "failed" or "cancelled".
+    """
+    results = {}
+
     if not steps:
         print("No images to download.")
-        return
+        return results
+
+    threads = threads or job.threads or DOWNLOAD_THREADS
+
+    # Adaptive jobs start at threads and let the limiter decide how many run at once
+    limiter = AdaptiveLimiter(threads) if job.adaptive else None
+    if limiter:
+        threads = limiter.maximum
+
+    # A connection per thread, like the async engine's connector
+    session = get_session(pool_size=threads)
 
     def worker(step: DownloadJobStep):
-        download_image(job, step)
+        if limiter:
+            limiter.acquire()
 
-    # Create a thread pool
-    thread_list = []
-    for step in steps:
-        if len(thread_list) >= threads:
-            for t in thread_list:
-                t.join()
-            thread_list.clear()
+        try:
+            # Steps that were still queued when the job got cancelled are skipped
+            if cancel_event.is_set():
+                return "cancelled"
 
-        t = threading.Thread(target=worker, args=(step,))
-        t.start()
-        thread_list.append(t)
+            if download_image(job, step, progress, limiter, session):
+                return "complete"
+            return "failed"
+        except Exception as e:
+            print(f"Unexpected error downloading step {step.id}: {e}")
+            return "failed"
+        finally:
+            if limiter:
+                limiter.release()
 
-    for t in thread_list:
-        t.join()
+    # Set by the progress aggregator once the job's cancel_requested is seen
+    cancel_event = threading.Event()
 
+    with ProgressAggregator(job, cancel_event) as progress:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = {executor.submit(worker, step): step for step in steps}
 
-def download_image(job: DownloadJob, download_job_step: DownloadJobStep):
+            for future in as_completed(futures):
+                results[futures[future].id] = future.result()
+
+    if limiter:
+        save_settled_concurrency(job, limiter)
+
+    return results
+
+
+def save_settled_concurrency(job: DownloadJob, limiter: AdaptiveLimiter):
+    job.settled_concurrency = limiter.limit
+    job.save(update_fields=["settled_concurrency"])
+    print(f"Download job {job.id} settled at {limiter.limit} concurrent downloads")
+
+
+def download_image(
+    job: DownloadJob,
+    download_job_step: DownloadJobStep,
+    progress: ProgressAggregator,
+    limiter: AdaptiveLimiter = None,
+    session: requests.Session = None,
+):
     link = download_job_step.image_link
-    save_path = f"{DOWNLOAD_BASE_FOLDER}\\{job.id}\\{download_job_step.issue_index_number}\\{download_job_step.page_number}.png"
+    save_path = image_path(job, download_job_step)
+    part_path = save_path + ".part"
+
+    if fetch_from_cache(download_job_step, save_path, progress):
+        progress.step_complete(download_job_step)
+        return True
+
+    # Continue from what an earlier attempt left in the .part file
+    offset = partial_size(part_path)
+    validator = read_validator(part_path)
+
+    start_time = time.perf_counter()
 
     try:
-        response = requests.get(link, stream=True)
-        response.raise_for_status()  # Raise an error for bad status codes
+        # Using a shared session keeps the connection to the image host alive
+        with (session or get_session()).get(
+            link,
+            stream=True,
+            timeout=DOWNLOAD_TIMEOUT,
+            headers=range_headers(offset, validator),
+        ) as response:
+            response.raise_for_status()  # Raise an error for bad status codes
 
-        with open(save_path, "wb") as file:
-            for chunk in response.iter_content(1024):  # Download in chunks
-                file.write(chunk)
+            if limiter:
+                limiter.record_success(time.perf_counter() - start_time)
 
-        # update db
-        job.downloaded_pages += 1
-        job.save()
+            mode = write_mode(response.status_code, response.headers, offset)
+            if mode is None:
+                raise requests.exceptions.RequestException(
+                    f"Unexpected Content-Range: {response.headers.get('Content-Range')}"
+                )
 
-        download_job_step.complete = True
-        download_job_step.save()
+            if mode == "wb":
+                save_validator(part_path, response.headers)
+
+            with open(part_path, mode) as file:
+                for chunk in response.iter_content(64 * 1024):  # Download in chunks
+                    file.write(chunk)
+
+        # Only complete images ever have the .png name
+        os.replace(part_path, save_path)
+        remove_validator(part_path)
+        store_in_cache(download_job_step, save_path)
+
+        progress.step_complete(download_job_step)
+        return True
 
     except requests.exceptions.RequestException as e:
-        print(
-            f"Failed to download {download_job_step.issue_index_number}, {download_job_step.page_number}, {download_job_step.image_link}"
-        )
-        download_job_step.retry = True
-        download_job_step.complete = False
-        download_job_step.save()
+        status_code = getattr(e.response, "status_code", None)
+
+        if limiter and (
+            isinstance(e, (requests.exceptions.Timeout, requests.ConnectionError))
+            or (status_code and is_throttled_status(status_code))
+        ):
+            limiter.record_throttled()
+
+        if offset and status_code == 416:
+            # The .part file doesn't match the image anymore, start over next time
+            os.remove(part_path)
+            remove_validator(part_path)
+
+        progress.step_failed(download_job_step)
+        return False
+
+
+def fetch_from_cache(
+    download_job_step: DownloadJobStep, save_path, progress: ProgressAggregator
+):
+    """
+    Fills save_path from the image cache when it's enabled.
+
+    Returns:
+        True if the image was in the cache.
+    """
+    if not image_cache.enabled():
+        return False
+
+    try:
+        hit = image_cache.fetch(download_job_step.image_link, save_path)
+    except OSError as e:
+        # e.g. the image was evicted meanwhile, download it instead
+        print(f"Could not read {download_job_step.image_link} from the cache: {e}")
+        hit = False
+
+    if hit:
+        progress.cache_hit()
+        return True
+
+    progress.cache_miss()
+    return False
+
+
+def store_in_cache(download_job_step: DownloadJobStep, save_path):
+    # The image is already downloaded, a cache that can't be written (e.g. a full disk)
+    # must not fail the step
+    if not image_cache.enabled():
+        return
+
+    try:
+        image_cache.store(download_job_step.image_link, save_path)
+    except Exception as e:
+        print(f"Could not cache {download_job_step.image_link}: {e}")
+
+
+def partial_size(part_path):
+    return os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+
+def range_headers(offset, validator):
+    """
+    Returns the headers that ask for the image from offset on. If-Range makes the
+    server send the whole image instead if it changed since the .part file was
+    started. Without a validator that can't be checked, so the whole image is asked for.
+    """
+    if not offset or not validator:
+        return {}
+
+    return {"Range": f"bytes={offset}-", "If-Range": validator}
+
+
+def validator_path(part_path):
+    return part_path + ".validator"
+
+
+def read_validator(part_path):
+    """
+    Returns the ETag or Last-Modified of the response the .part file was started from,
+    or None.
+    """
+    try:
+        with open(validator_path(part_path)) as file:
+            return file.read() or None
+    except FileNotFoundError:
+        return None
+
+
+def save_validator(part_path, headers):
+    """
+    Saves the validator of a response that starts a new .part file. Weak ETags can't be
+    used with If-Range, Last-Modified is used then.
+    """
+    etag = headers.get("ETag")
+    validator = etag if etag and not etag.startswith("W/") else None
+    validator = validator or headers.get("Last-Modified")
+
+    if validator:
+        with open(validator_path(part_path), "w") as file:
+            file.write(validator)
+    else:
+        remove_validator(part_path)
+
+
+def remove_validator(part_path):
+    if os.path.exists(validator_path(part_path)):
+        os.remove(validator_path(part_path))
+
+
+def write_mode(status_code, headers, offset):
+    """
+    Returns the mode to open the .part file with for a response: "ab" when the server
+    sent the rest of the image, "wb" when it sent the whole image, or None when the
+    response is a range that doesn't continue the .part file.
+    """
+    if status_code != 206:
+        return "wb"
+
+    if headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+        return "ab"
+
+    return None
 
 
 # Recursively removes a download job's folder and it's contents
@@ -81,27 +320,353 @@ def recursive_remove_folder(job: DownloadJob):
 
 
 def combine(job: DownloadJob):
+    """
+    Combines the job's images into a PDF in the job folder. Each issue is converted on
+    its own and the issue PDFs are then joined, so only one issue's images are held in
+    memory at a time. Jobs with more than COMBINE_MAX_VOLUME_BYTES of images are split
+    into several volumes. The time taken and the peak RSS while writing are saved on the
+    job.
+
+    Returns:
+        A dictionary with the created file names, the seconds taken and the peak RSS
+        in KB, or None if there were no images.
+    """
+    start_time = time.perf_counter()
+
     cleaned = sanitize_filename(job.name)
     folder = f"{DOWNLOAD_BASE_FOLDER}\\{job.id}"
-    output_pdf_path = os.path.join(folder, f"{cleaned}.pdf")
 
-    image_paths = []
+    issues = [image_paths for _, image_paths in issue_image_paths(job) if image_paths]
+
+    if not issues:
+        print("No images found to combine.")
+        return None
+
+    volumes = split_into_volumes(issues, COMBINE_MAX_VOLUME_BYTES)
+
+    files = []
+    with RssSampler() as rss:
+        for number, volume in enumerate(volumes, start=1):
+            if len(volumes) == 1:
+                file_name = f"{cleaned}.pdf"
+            else:
+                file_name = f"{cleaned} - Volume {number}.pdf"
+
+            write_pdf(volume, os.path.join(folder, file_name))
+            files.append(file_name)
+
+    return save_combine_stats(job, start_time, files, rss.peak_kb)
 
-    # Sort subdirectories numerically
-    for sub_dir in sorted(os.listdir(folder), key=lambda x: int(x)):
+
+def combine_cbz(job: DownloadJob, per_issue=False):
+    """
+    Packs the job's images into a CBZ, or one CBZ per issue. Entries are stored without
+    compression and copied straight from the issue folders, so this costs little more
+    than reading the images once.
+
+    Returns:
+        The same dictionary as combine(), or None if there were no images.
+    """
+    start_time = time.perf_counter()
+
+    cleaned = sanitize_filename(job.name)
+    folder = f"{DOWNLOAD_BASE_FOLDER}\\{job.id}"
+
+    # Issues without images are left out, the folder index still identifies the issue
+    issues = [
+        (index, image_paths)
+        for index, image_paths in issue_image_paths(job)
+        if image_paths
+    ]
+
+    if not issues:
+        print("No images found to combine.")
+        return None
+
+    files = []
+    with RssSampler() as rss:
+        if per_issue:
+            titles = issue_titles(job)
+            for index, image_paths in issues:
+                title = sanitize_filename(titles.get(index, cleaned))
+                file_name = f"{index + 1:03d} - {title}.cbz"
+                write_cbz([image_paths], os.path.join(folder, file_name))
+                files.append(file_name)
+        else:
+            file_name = f"{cleaned}.cbz"
+            write_cbz(
+                [image_paths for _, image_paths in issues],
+                os.path.join(folder, file_name),
+            )
+            files.append(file_name)
+
+    return save_combine_stats(job, start_time, files, rss.peak_kb)
+
+
+def package(job: DownloadJob):
+    """
+    Combines the job's images in the output format selected for the job.
+    """
+    if job.output_format == "cbz":
+        return combine_cbz(job)
+    if job.output_format == "cbz_issues":
+        return combine_cbz(job, per_issue=True)
+
+    return combine(job)
+
+
+def save_combine_stats(job: DownloadJob, start_time, files, peak_rss_kb):
+    job.combine_seconds = time.perf_counter() - start_time
+    job.combine_peak_rss_kb = peak_rss_kb
+    job.save(update_fields=["combine_seconds", "combine_peak_rss_kb"])
+
+    print(
+        f"Combined job {job.id} into {len(files)} file(s) in {job.combine_seconds:.1f}s, "
+        f"peak RSS {job.combine_peak_rss_kb} KB"
+    )
+
+    return {
+        "files": files,
+        "seconds": job.combine_seconds,
+        "peak_rss_kb": job.combine_peak_rss_kb,
+    }
+
+
+def issue_image_paths(job: DownloadJob):
+    """
+    Returns an (index, image paths) tuple for each issue folder of the job, in reading
+    order. The index is the folder's issue_index_number.
+    """
+    folder = f"{DOWNLOAD_BASE_FOLDER}\\{job.id}"
+    issues = []
+
+    # Sort subdirectories numerically, combined files live next to them
+    sub_dirs = [sub_dir for sub_dir in os.listdir(folder) if sub_dir.isdigit()]
+    for sub_dir in sorted(sub_dirs, key=lambda x: int(x)):
         sub_dir_path = os.path.join(folder, sub_dir)
 
         if os.path.isdir(sub_dir_path):  # Ensure it's a directory
             # Sort images numerically and add to the list
+            # Unfinished downloads are left as .part files, skip them
             images = sorted(
-                os.listdir(sub_dir_path), key=lambda x: int(os.path.splitext(x)[0])
+                (img for img in os.listdir(sub_dir_path) if img.endswith(".png")),
+                key=lambda x: int(os.path.splitext(x)[0]),
+            )
+            issues.append(
+                (int(sub_dir), [os.path.join(sub_dir_path, img) for img in images])
             )
-            image_paths.extend(os.path.join(sub_dir_path, img) for img in images)
 
-    if not image_paths:
-        print("No images found to combine.")
-        return
+    return issues
+
+
+def split_into_volumes(issues, max_volume_bytes):
+    """
+    Groups consecutive issues into volumes of at most max_volume_bytes of images. An
+    issue is never split, and a max_volume_bytes of 0 puts everything in one volume.
+    """
+    if not max_volume_bytes:
+        return [issues]
+
+    volumes = [[]]
+    volume_bytes = 0
+
+    for image_paths in issues:
+        issue_bytes = sum(os.path.getsize(path) for path in image_paths)
+
+        if volumes[-1] and volume_bytes + issue_bytes > max_volume_bytes:
+            volumes.append([])
+            volume_bytes = 0
+
+        volumes[-1].append(image_paths)
+        volume_bytes += issue_bytes
+
+    return volumes
+
+
+def write_pdf(issues, output_path):
+    """
+    Writes a PDF of the issues' images. Every issue is converted to its own temporary
+    PDF first, pikepdf then copies their pages into the output while reading the image
+    data from the temporary files instead of keeping it in memory.
+
+    At most COMBINE_MERGE_CHUNK_SIZE PDFs are open at a time. Jobs with more issues are
+    joined into intermediate PDFs of that many issues first, and those are joined next.
+    """
+    temporary_paths = []
+
+    try:
+        pdf_paths = []
+        for index, image_paths in enumerate(issues):
+            issue_pdf_path = f"{output_path}.{index}.part"
+            with open(issue_pdf_path, "wb") as pdf_file:
+                img2pdf.convert(image_paths, outputstream=pdf_file)
+            temporary_paths.append(issue_pdf_path)
+            pdf_paths.append(issue_pdf_path)
+
+        merge_round = 0
+        while len(pdf_paths) > COMBINE_MERGE_CHUNK_SIZE:
+            merged_paths = []
+            for start in range(0, len(pdf_paths), COMBINE_MERGE_CHUNK_SIZE):
+                merged_path = f"{output_path}.merged-{merge_round}-{start}.part"
+                merge_pdfs(
+                    pdf_paths[start : start + COMBINE_MERGE_CHUNK_SIZE], merged_path
+                )
+                temporary_paths.append(merged_path)
+                merged_paths.append(merged_path)
+
+            pdf_paths = merged_paths
+            merge_round += 1
+
+        merge_pdfs(pdf_paths, output_path + ".part")
+        os.replace(output_path + ".part", output_path)
+    finally:
+        for temporary_path in temporary_paths:
+            os.remove(temporary_path)
+
+
+def merge_pdfs(pdf_paths, output_path):
+    """
+    Writes the pages of the given PDFs, in order, into a new PDF. pikepdf reads the
+    pages' data from the sources while saving, so they stay open until then.
+    """
+    pdfs = []
+
+    try:
+        for pdf_path in pdf_paths:
+            pdfs.append(pikepdf.open(pdf_path))
+
+        with pikepdf.Pdf.new() as pdf:
+            for source in pdfs:
+                pdf.pages.extend(source.pages)
+            pdf.save(output_path)
+    finally:
+        for source in pdfs:
+            source.close()
+
+
+def write_cbz(issues, output_path):
+    # Pages are zero padded so readers that sort entries by name keep the order
+    with zipfile.ZipFile(
+        output_path + ".part", "w", compression=zipfile.ZIP_STORED
+    ) as archive:
+        for index, image_paths in enumerate(issues):
+            for page_number, image_path in enumerate(image_paths, start=1):
+                if len(issues) == 1:
+                    arcname = f"{page_number:04d}.png"
+                else:
+                    arcname = f"{index + 1:03d}/{page_number:04d}.png"
+
+                archive.write(image_path, arcname)
+
+    os.replace(output_path + ".part", output_path)
+
+
+def issue_titles(job: DownloadJob):
+    """
+    Returns a dictionary mapping the job's issue folder numbers to issue titles.
+    """
+    issue_links = dict(
+        DownloadJobStep.objects.filter(download_job=job)
+        .values_list("issue_index_number", "issue_link")
+        .distinct()
+    )
+    titles = dict(
+        Issue.objects.filter(link__in=issue_links.values()).values_list("link", "title")
+    )
+
+    return {
+        index: titles[link] for index, link in issue_links.items() if link in titles
+    }
+
+
+def current_rss_kb():
+    # The working set on Windows, /proc on Linux, None anywhere else
+    if os.name == "nt":
+        return windows_working_set_kb()
+
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except OSError:
+        return None
+
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def windows_working_set_kb():
+    from ctypes import wintypes
+    import ctypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        # PROCESS_MEMORY_COUNTERS from psapi.h
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    kernel32 = ctypes.WinDLL("kernel32")
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    kernel32.K32GetProcessMemoryInfo.argtypes = [
+        wintypes.HANDLE,
+        ctypes.POINTER(ProcessMemoryCounters),
+        wintypes.DWORD,
+    ]
+    kernel32.K32GetProcessMemoryInfo.restype = wintypes.BOOL
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not kernel32.K32GetProcessMemoryInfo(
+        kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb
+    ):
+        return None
+
+    return counters.WorkingSetSize // 1024
+
+
+class RssSampler:
+    """
+    Samples the process' RSS from a background thread while the block runs. peak_kb is
+    the highest sample, so it covers only this block and not everything the process
+    did before it, unlike ru_maxrss. Spikes shorter than COMBINE_RSS_SAMPLE_INTERVAL
+    can be missed. peak_kb stays None where the RSS can't be read.
+
+    Usage:
+        with RssSampler() as rss:
+            write_pdf(issues, output_path)
+        print(rss.peak_kb)
+    """
+
+    def __init__(self, interval=COMBINE_RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_kb = None
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stopped.set()
+        self._thread.join()
+        self.sample()
+
+    def sample(self):
+        rss_kb = current_rss_kb()
+        if rss_kb is not None and (self.peak_kb is None or rss_kb > self.peak_kb):
+            self.peak_kb = rss_kb
 
-    # Convert images to PDF
-    with open(output_pdf_path, "wb") as pdf_file:
-        pdf_file.write(img2pdf.convert(image_paths))
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
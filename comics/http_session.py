@@ -0,0 +1,54 @@
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import threading
+import requests
+import os
+
+load_dotenv()
+
+# Least number of keep-alive connections kept open per image host, sessions for jobs
+# with more threads get a connection per thread, see get_session
+DOWNLOAD_POOL_SIZE = int(os.getenv("DOWNLOAD_POOL_SIZE", 16))
+# Number of different hosts that get their own connection pool
+DOWNLOAD_POOL_HOSTS = int(os.getenv("DOWNLOAD_POOL_HOSTS", 10))
+
+# (connect, read) timeouts used for every image request
+DOWNLOAD_TIMEOUT = (
+    float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", 10)),
+    float(os.getenv("DOWNLOAD_READ_TIMEOUT", 60)),
+)
+
+# Shared sessions by pool size
+_sessions = {}
+_session_lock = threading.Lock()
+
+
+def create_session(pool_size=DOWNLOAD_POOL_SIZE, pool_hosts=DOWNLOAD_POOL_HOSTS):
+    """
+    Creates a requests session that keeps connections alive and reuses them between
+    requests. Threads wait for a free connection once pool_size connections to a host
+    are in use, so the number of open connections per host stays bounded.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_hosts, pool_maxsize=pool_size, pool_block=True
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def get_session(pool_size=DOWNLOAD_POOL_SIZE):
+    """
+    Returns a session shared by the image downloads in this process with at least
+    pool_size connections per host. Jobs should ask for one connection per download
+    thread, otherwise the extra threads wait for a connection to be free.
+    """
+    pool_size = max(pool_size, DOWNLOAD_POOL_SIZE)
+
+    with _session_lock:
+        if pool_size not in _sessions:
+            _sessions[pool_size] = create_session(pool_size=pool_size)
+
+        return _sessions[pool_size]
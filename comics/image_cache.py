@@ -0,0 +1,139 @@
+from dotenv import load_dotenv
+from django.db.models import Max
+from django.utils import timezone
+from comics.models import CachedImage
+import tempfile
+import hashlib
+import shutil
+import os
+
+load_dotenv()
+
+# Folder of the image cache shared by all download jobs, the cache is off when unset
+IMAGE_CACHE_FOLDER = os.getenv("IMAGE_CACHE_FOLDER")
+# Least recently used images are evicted once the cache grows past this size
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 10 * 1024**3))
+
+
+def enabled():
+    return bool(IMAGE_CACHE_FOLDER)
+
+
+def blob_path(content_hash):
+    # Images are stored by content hash, links to identical images share one file
+    return os.path.join(IMAGE_CACHE_FOLDER, content_hash[:2], content_hash)
+
+
+def fetch(image_link, save_path):
+    """
+    Fills save_path with the cached image for image_link.
+
+    Returns:
+        True if the image was in the cache.
+    """
+    entry = CachedImage.objects.filter(image_link=image_link).first()
+    if entry is None:
+        return False
+
+    path = blob_path(entry.content_hash)
+    if not os.path.exists(path):
+        entry.delete()
+        return False
+
+    link_or_copy(path, save_path)
+    CachedImage.objects.filter(id=entry.id).update(last_used=timezone.now())
+
+    return True
+
+
+def store(image_link, path):
+    """
+    Adds a downloaded image to the cache.
+    """
+    content_hash = file_hash(path)
+    cached_path = blob_path(content_hash)
+
+    if not os.path.exists(cached_path):
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        link_or_copy(path, cached_path)
+
+    CachedImage.objects.update_or_create(
+        image_link=image_link,
+        defaults={
+            "content_hash": content_hash,
+            "size": os.path.getsize(cached_path),
+            "last_used": timezone.now(),
+        },
+    )
+
+
+def evict(max_bytes=None):
+    """
+    Removes the least recently used images until the cache fits in max_bytes.
+
+    Returns:
+        The number of images removed.
+    """
+    max_bytes = IMAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    # One row per stored file, a file is as recent as the most recent link using it
+    blobs = (
+        CachedImage.objects.values("content_hash")
+        .annotate(size=Max("size"), last_used=Max("last_used"))
+        .order_by("last_used")
+    )
+
+    total_size = sum(blob["size"] for blob in blobs)
+    removed = 0
+
+    for blob in blobs:
+        if total_size <= max_bytes:
+            break
+
+        CachedImage.objects.filter(content_hash=blob["content_hash"]).delete()
+        path = blob_path(blob["content_hash"])
+        if os.path.exists(path):
+            os.remove(path)
+
+        total_size -= blob["size"]
+        removed += 1
+
+    return removed
+
+
+def link_or_copy(source, destination):
+    """
+    Hardlinks source to destination, or copies it when the filesystem can't link.
+    The destination is replaced atomically. Every call goes through its own temporary
+    file, so concurrent calls for the same destination don't interfere.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(destination),
+        prefix=os.path.basename(destination) + ".",
+        suffix=".tmp",
+    )
+    os.close(fd)
+
+    try:
+        # os.link can't replace the file mkstemp reserved the name with
+        os.remove(temp_path)
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+
+        os.replace(temp_path, destination)
+    finally:
+        # Also left behind when it's a link to destination already, renaming a file
+        # over another link to it does nothing
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
@@ -0,0 +1,191 @@
+from contextlib import contextmanager
+from datetime import timedelta
+from dotenv import load_dotenv
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from comics.models import DownloadJob, DownloadJobStep, Issue, Page
+from comics.downloader import create_folders, run_download, package
+from comics import image_cache
+import threading
+import time
+import os
+
+load_dotenv()
+
+# Seconds the download worker waits before looking for new jobs again
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", 2))
+# Seconds between heartbeats of a running job
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", 30))
+# A running job without a heartbeat for this many seconds lost its worker (crashed or
+# killed) and is claimed again
+WORKER_STALE_AFTER = float(os.getenv("WORKER_STALE_AFTER", 300))
+
+# Job statuses
+# pending: created, steps are still being planned
+# queued: waiting for a download worker
+# running: claimed by a download worker
+# done: every page is downloaded and combined into the output format
+# incomplete: stopped with pages left to download, can be retried
+PENDING = "pending"
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+INCOMPLETE = "incomplete"
+
+
+def plan_job(job: DownloadJob, issue_ids):
+    """
+    Creates a step for every page of the issues, the issues numbered in the order of
+    issue_ids. The issues and their pages are loaded in two queries and the steps are
+    inserted in bulk. Call it inside a transaction with the job's creation, so a failed
+    plan leaves nothing behind.
+
+    Raises:
+        ValueError: If any of the issue ids doesn't exist. Nothing is written.
+    """
+    start_time = time.perf_counter()
+
+    issues = Issue.objects.in_bulk(issue_ids)
+    unknown_ids = [issue_id for issue_id in issue_ids if issue_id not in issues]
+    if unknown_ids:
+        raise ValueError(f"Unknown issue ids: {unknown_ids}")
+
+    pages_by_issue = {issue_id: [] for issue_id in issues}
+    for page in Page.objects.filter(issue_id__in=issues).order_by("id"):
+        pages_by_issue[page.issue_id_id].append(page)
+
+    steps = [
+        DownloadJobStep(
+            download_job=job,
+            page=page,
+            image_link=page.image_link,
+            page_number=page.page_number,
+            issue_index_number=issue_index,
+            complete=False,
+            issue_link=issues[issue_id].link,
+            retry=False,
+        )
+        for issue_index, issue_id in enumerate(issue_ids)
+        for page in pages_by_issue[issue_id]
+    ]
+    DownloadJobStep.objects.bulk_create(steps, batch_size=1000)
+
+    job.total_pages = len(steps)
+    job.total_issues = len(issue_ids)
+    job.planning_seconds = time.perf_counter() - start_time
+    job.save(update_fields=["total_pages", "total_issues", "planning_seconds"])
+
+
+def enqueue_job(job: DownloadJob):
+    """
+    Queues the job for the download worker (manage.py run_download_worker). A retried
+    job is no longer complete until the worker finishes it again.
+    """
+    job.status = QUEUED
+    job.complete = False
+    job.cancel_requested = False
+    job.save(update_fields=["status", "complete", "cancel_requested"])
+
+
+def claim_next_job():
+    """
+    Claims the oldest queued job, or a running job whose worker stopped sending
+    heartbeats. Rows locked by other workers are skipped, so several workers can poll
+    the queue without claiming the same job.
+
+    Returns:
+        The claimed job, or None if the queue is empty.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=WORKER_STALE_AFTER)
+
+    with transaction.atomic():
+        job = (
+            DownloadJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=QUEUED)
+                | Q(status=RUNNING, heartbeat_at__lt=stale)
+                | Q(status=RUNNING, heartbeat_at__isnull=True, claimed_at__lt=stale)
+            )
+            .order_by("id")
+            .first()
+        )
+
+        if job is None:
+            return None
+
+        if job.status == RUNNING:
+            print(f"Download job {job.id} lost its worker, claiming it again")
+
+        job.status = RUNNING
+        job.claimed_at = now
+        job.heartbeat_at = now
+        job.save(update_fields=["status", "claimed_at", "heartbeat_at"])
+
+    return job
+
+
+@contextmanager
+def heartbeat(job: DownloadJob):
+    """
+    Refreshes the job's heartbeat_at every WORKER_HEARTBEAT_INTERVAL seconds while the
+    block runs, so other workers don't claim it as stale.
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(WORKER_HEARTBEAT_INTERVAL):
+            DownloadJob.objects.filter(id=job.id).update(heartbeat_at=timezone.now())
+        # The thread has its own connection, close it before the thread exits
+        connection.close()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def process_job(job: DownloadJob):
+    """
+    Downloads the job's incomplete steps and combines the images once every step is
+    complete. Progress is written to the job while it runs.
+    """
+    # Combining can take as long as downloading, the heartbeat covers both
+    with heartbeat(job):
+        try:
+            incomplete_steps = DownloadJobStep.objects.filter(
+                download_job_id=job.id, complete=False
+            )
+
+            create_folders(job)
+            run_download(job, incomplete_steps)
+
+            if image_cache.enabled():
+                image_cache.evict()
+
+            # Update the job if no more things to download. Asked with a new query,
+            # the engines evaluate incomplete_steps and its cached result would still
+            # list every step.
+            steps_left = DownloadJobStep.objects.filter(
+                download_job_id=job.id, complete=False
+            ).exists()
+            if not steps_left:
+                package(job)
+                job.complete = True
+                job.status = DONE
+            else:
+                job.status = INCOMPLETE
+        except Exception as e:
+            print(f"Download job {job.id} failed: {e}")
+            job.status = INCOMPLETE
+
+    # An update instead of save(), which raises if the job was deleted meanwhile
+    saved = DownloadJob.objects.filter(id=job.id).update(
+        complete=job.complete, status=job.status
+    )
+    if not saved:
+        print(f"Download job {job.id} was deleted while it ran")
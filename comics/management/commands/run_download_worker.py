@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from comics.jobs import claim_next_job, process_job, WORKER_POLL_INTERVAL
+import time
+
+
+class Command(BaseCommand):
+    help = "Runs queued download jobs. Start as many workers as needed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job()
+
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(WORKER_POLL_INTERVAL)
+                continue
+
+            self.stdout.write(f"Starting download job {job.id} ({job.name})")
+            process_job(job)
+            self.stdout.write(f"Download job {job.id} finished: {job.status}")
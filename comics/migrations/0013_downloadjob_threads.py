@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0012_alter_downloadjobstep_issue_link"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadjob",
+            name="threads",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
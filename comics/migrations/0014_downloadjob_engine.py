@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0013_downloadjob_threads"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadjob",
+            name="engine",
+            field=models.CharField(default="threaded", max_length=16),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:45
+
+from django.db import migrations, models
+
+
+def set_status_of_existing_jobs(apps, schema_editor):
+    DownloadJob = apps.get_model("comics", "DownloadJob")
+    DownloadJob.objects.filter(complete=True).update(status="done")
+    DownloadJob.objects.filter(complete=False).update(status="incomplete")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0014_downloadjob_engine"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadjob",
+            name="cancel_requested",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="downloadjob",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="downloadjob",
+            name="status",
+            field=models.CharField(db_index=True, default="pending", max_length=16),
+        ),
+        migrations.RunPython(set_status_of_existing_jobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0015_downloadjob_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CachedImage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("image_link", models.URLField(max_length=500, unique=True)),
+                ("content_hash", models.CharField(db_index=True, max_length=64)),
+                ("size", models.BigIntegerField()),
+                ("last_used", models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="downloadjob",
+            name="cache_hits",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="downloadjob",
+            name="cache_misses",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0016_cachedimage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadjob",
+            name="combine_peak_rss_kb",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="downloadjob",
+            name="combine_seconds",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0017_downloadjob_combine_stats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadjob",
+            name="output_format",
+            field=models.CharField(default="pdf", max_length=16),
+        ),
+    ]
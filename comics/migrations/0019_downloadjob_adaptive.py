@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0018_downloadjob_output_format"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadjob",
+            name="adaptive",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="downloadjob",
+            name="settled_concurrency",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0019_downloadjob_adaptive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comic",
+            name="content_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0020_comic_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comic",
+            name="last_refreshed",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="comic",
+            name="status",
+            field=models.CharField(blank=True, default="", max_length=32),
+        ),
+        migrations.CreateModel(
+            name="ComicRefresh",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("started_at", models.DateTimeField()),
+                ("finished_at", models.DateTimeField()),
+                ("status", models.CharField(max_length=16)),
+                ("new_issues", models.IntegerField(default=0)),
+                ("changed_issues", models.IntegerField(default=0)),
+                ("removed_issues", models.IntegerField(default=0)),
+                ("error", models.TextField(blank=True, default="")),
+                (
+                    "comic",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="refreshes",
+                        to="comics.comic",
+                    ),
+                ),
+            ],
+        ),
+    ]
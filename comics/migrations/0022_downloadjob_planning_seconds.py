@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0021_comic_refresh"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadjob",
+            name="planning_seconds",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,53 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models.functions import Upper
+
+# GIN indexes only exist on PostgreSQL, so they're created here instead of in
+# Comic.Meta.indexes. Other databases search without them, see comics.search.
+SEARCH_INDEXES = [
+    # full-text search, same expression as comics.search.SEARCH_VECTOR
+    GinIndex(
+        SearchVector("title", "writers", "artists", config="simple"),
+        name="comic_search_vector",
+    ),
+    # title__icontains, which compares UPPER(title)
+    GinIndex(
+        OpClass(Upper("title"), name="gin_trgm_ops"), name="comic_title_upper_trgm"
+    ),
+    # title__trigram_word_similar
+    GinIndex(fields=["title"], opclasses=["gin_trgm_ops"], name="comic_title_trgm"),
+]
+
+
+def add_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    # gin_trgm_ops comes from pg_trgm. Not TrigramExtension(), its reverse fails on
+    # other databases. The extension is left in place on reverse.
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    Comic = apps.get_model("comics", "Comic")
+    for index in SEARCH_INDEXES:
+        schema_editor.add_index(Comic, index)
+
+
+def remove_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    Comic = apps.get_model("comics", "Comic")
+    for index in SEARCH_INDEXES:
+        schema_editor.remove_index(Comic, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0022_downloadjob_planning_seconds"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_indexes, remove_search_indexes),
+    ]
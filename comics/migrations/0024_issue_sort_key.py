@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:05
+
+from django.db import migrations, models
+import unicodedata
+import re
+
+
+# Copy of comics.utils.natural_sort_key as of this migration, so later changes to it
+# don't change what the migration writes
+def natural_sort_key(title):
+    key = bytearray()
+    title = unicodedata.normalize("NFD", title)
+
+    for index, part in enumerate(re.split(r"(\d+)", title)):
+        if index % 2 == 0:
+            key += part.encode() + b"\x00"
+        else:
+            digits = str(int(part))
+            key += bytes([len(digits)]) + digits.encode()
+
+    return bytes(key)
+
+
+def set_sort_keys(apps, schema_editor):
+    Issue = apps.get_model("comics", "Issue")
+
+    issues = []
+    for issue in Issue.objects.only("id", "title").iterator(chunk_size=1000):
+        issue.sort_key = natural_sort_key(issue.title)
+        issues.append(issue)
+
+        if len(issues) == 1000:
+            Issue.objects.bulk_update(issues, ["sort_key"])
+            issues = []
+
+    Issue.objects.bulk_update(issues, ["sort_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0023_comic_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="issue",
+            name="sort_key",
+            field=models.BinaryField(default=b""),
+        ),
+        migrations.AddIndex(
+            model_name="issue",
+            index=models.Index(
+                fields=["comic_id", "sort_key"], name="issue_comic_sort_key"
+            ),
+        ),
+        migrations.RunPython(set_sort_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:18
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+# Comics keep their place in the refresh order
+def copy_last_refreshed(apps, schema_editor):
+    Comic = apps.get_model("comics", "Comic")
+    Comic.objects.update(refresh_attempted_at=F("last_refreshed"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("comics", "0025_downloadjob_heartbeat_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comic",
+            name="refresh_attempted_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(copy_last_refreshed, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from comics.utils import natural_sort_key
 
 
 class Comic(models.Model):
@@ -9,16 +10,55 @@ class Comic(models.Model):
     artists = models.CharField(max_length=255)
     number_issues = models.IntegerField()
     last_updated = models.DateTimeField(auto_now=True)
+    # sha256 of the info page when it was last crawled
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    # publication status from the info page, e.g. "Ongoing" or "Completed"
+    status = models.CharField(max_length=32, blank=True, default="")
+    # last time the catalog refresh crawled the comic, changed or not
+    last_refreshed = models.DateTimeField(null=True, blank=True, db_index=True)
+    # last time the catalog refresh tried the comic, failed or not, see rcoli.scheduler
+    refresh_attempted_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return self.title
 
 
+class ComicRefresh(models.Model):
+    # result of refreshing one comic, see rcoli.scheduler
+    comic = models.ForeignKey(Comic, on_delete=models.CASCADE, related_name="refreshes")
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    # "updated", "unchanged" or "failed"
+    status = models.CharField(max_length=16)
+    new_issues = models.IntegerField(default=0)
+    changed_issues = models.IntegerField(default=0)
+    removed_issues = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+
+
 class Issue(models.Model):
     title = models.CharField(max_length=255)
     link = models.URLField(unique=True, null=False, blank=False)
     comic_id = models.ForeignKey(Comic, on_delete=models.CASCADE, related_name="issues")
     pages = models.IntegerField()
+    # natural_sort_key(title), issues are ordered by it in the database. Set by save(),
+    # bulk inserts and updates have to set it themselves.
+    sort_key = models.BinaryField(default=b"")
+
+    class Meta:
+        # a comic's issues are always listed in sort key order
+        indexes = [
+            models.Index(fields=["comic_id", "sort_key"], name="issue_comic_sort_key")
+        ]
+
+    def save(self, *args, **kwargs):
+        self.sort_key = natural_sort_key(self.title)
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "title" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "sort_key"}
+
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
@@ -43,6 +83,30 @@ class DownloadJob(models.Model):
     total_issues = models.IntegerField()
     complete = models.BooleanField()
     name = models.CharField(max_length=255, null=False, blank=False)
+    # number of concurrent image downloads, null uses the global default
+    threads = models.IntegerField(null=True, blank=True)
+    # let comics.concurrency.AdaptiveLimiter tune the number of concurrent downloads
+    adaptive = models.BooleanField(default=False)
+    # concurrency an adaptive job ended its last download at
+    settled_concurrency = models.IntegerField(null=True, blank=True)
+    # download engine, "threaded" or "async"
+    engine = models.CharField(max_length=16, default="threaded")
+    # queue status, see comics.jobs
+    status = models.CharField(max_length=16, default="pending", db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    # refreshed by the worker while the job runs, see comics.jobs.heartbeat
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    cancel_requested = models.BooleanField(default=False)
+    # pages filled from / missing in the image cache, see comics.image_cache
+    cache_hits = models.IntegerField(default=0)
+    cache_misses = models.IntegerField(default=0)
+    # "pdf", "cbz" or "cbz_issues" (one archive per issue)
+    output_format = models.CharField(max_length=16, default="pdf")
+    # measurements of the last combine() of the job
+    combine_seconds = models.FloatField(null=True, blank=True)
+    combine_peak_rss_kb = models.IntegerField(null=True, blank=True)
+    # seconds spent creating the job's steps, see comics.jobs.plan_job
+    planning_seconds = models.FloatField(null=True, blank=True)
 
 
 class DownloadJobStep(models.Model):
@@ -59,3 +123,11 @@ class DownloadJobStep(models.Model):
     complete = models.BooleanField()
     issue_link = models.URLField(null=False, blank=False)
     retry = models.BooleanField()
+
+
+class CachedImage(models.Model):
+    # image cache entry, the file is stored under its content hash
+    image_link = models.URLField(unique=True, max_length=500, null=False, blank=False)
+    content_hash = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    last_used = models.DateTimeField(db_index=True)
@@ -0,0 +1,133 @@
+from dotenv import load_dotenv
+from django.db import connection, transaction
+from django.db.models import F
+from comics.models import DownloadJob, DownloadJobStep
+import threading
+import os
+
+load_dotenv()
+
+# Seconds between two writes of a job's progress to the database
+PROGRESS_FLUSH_INTERVAL = float(os.getenv("PROGRESS_FLUSH_INTERVAL", 0.5))
+
+
+class ProgressAggregator:
+    """
+    Collects the results of a job's steps from the download workers and writes them to
+    the database in batches from a background thread. Completed pages are added to the
+    job with an F() increment, so counts can't be lost to concurrent writers.
+
+    If a cancel_event is given it is set once job.cancel_requested is found on a flush,
+    which lets a job running in the download worker be cancelled from the API.
+
+    Usage:
+        with ProgressAggregator(job) as progress:
+            progress.step_complete(step)
+    """
+
+    def __init__(
+        self,
+        job: DownloadJob,
+        cancel_event=None,
+        flush_interval=PROGRESS_FLUSH_INTERVAL,
+    ):
+        self.job = job
+        self.cancel_event = cancel_event
+        self.flush_interval = flush_interval
+
+        self._completed = []
+        self._failed = []
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def step_complete(self, step: DownloadJobStep):
+        step.complete = True
+        with self._lock:
+            self._completed.append(step.id)
+
+    def step_failed(self, step: DownloadJobStep):
+        print(
+            f"Failed to download {step.issue_index_number}, {step.page_number}, {step.image_link}"
+        )
+        step.retry = True
+        step.complete = False
+        with self._lock:
+            self._failed.append(step.id)
+
+    def cache_hit(self):
+        with self._lock:
+            self._cache_hits += 1
+
+    def cache_miss(self):
+        with self._lock:
+            self._cache_misses += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread, writes whatever is left and refreshes the job's
+        counters from the database.
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+        self.flush()
+        self.job.refresh_from_db(
+            fields=["downloaded_pages", "cache_hits", "cache_misses"]
+        )
+
+    def flush(self):
+        with self._lock:
+            completed, self._completed = self._completed, []
+            failed, self._failed = self._failed, []
+            cache_hits, self._cache_hits = self._cache_hits, 0
+            cache_misses, self._cache_misses = self._cache_misses, 0
+
+        if not (completed or failed or cache_hits or cache_misses):
+            return
+
+        with transaction.atomic():
+            if completed:
+                DownloadJobStep.objects.filter(id__in=completed).update(complete=True)
+
+            if completed or cache_hits or cache_misses:
+                DownloadJob.objects.filter(id=self.job.id).update(
+                    downloaded_pages=F("downloaded_pages") + len(completed),
+                    cache_hits=F("cache_hits") + cache_hits,
+                    cache_misses=F("cache_misses") + cache_misses,
+                )
+
+            if failed:
+                DownloadJobStep.objects.filter(id__in=failed).update(
+                    retry=True, complete=False
+                )
+
+    def _cancel_requested(self):
+        return DownloadJob.objects.filter(
+            id=self.job.id, cancel_requested=True
+        ).exists()
+
+    def _run(self):
+        try:
+            while not self._stopped.wait(self.flush_interval):
+                self.flush()
+
+                if self.cancel_event is not None and self._cancel_requested():
+                    self.cancel_event.set()
+        finally:
+            # Each thread gets its own connection, close it before the thread exits
+            connection.close()
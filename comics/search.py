@@ -0,0 +1,63 @@
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramWordSimilarity,
+)
+from django.db import connection
+from django.db.models import Q
+from comics.models import Comic
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+# Results per page when the request doesn't set a limit, and the most it may ask for
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", 50))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", 200))
+
+# "simple" doesn't stem or drop stop words, titles and names are matched as written
+SEARCH_CONFIG = "simple"
+
+# Must match the expression of the comic_search_vector index in migration 0023, or
+# PostgreSQL won't use the index
+SEARCH_VECTOR = SearchVector("title", "writers", "artists", config=SEARCH_CONFIG)
+
+
+def find_comics(query, limit=SEARCH_DEFAULT_LIMIT, offset=0):
+    """
+    Searches comics by title, writers and artists, best matches first.
+
+    On PostgreSQL comics match on full-text search or on a title that contains the
+    query or is similar to it (pg_trgm), all backed by GIN indexes. Matches are ranked
+    by full-text rank plus title similarity. Other databases fall back to a
+    case-insensitive contains search ordered by title.
+
+    Returns:
+        A list of (comic, rank) tuples, rank is None without PostgreSQL.
+    """
+    if connection.vendor != "postgresql":
+        comics = Comic.objects.filter(
+            Q(title__icontains=query)
+            | Q(writers__icontains=query)
+            | Q(artists__icontains=query)
+        ).order_by("title", "id")
+        return [(comic, None) for comic in comics[offset : offset + limit]]
+
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+
+    comics = (
+        Comic.objects.alias(search=SEARCH_VECTOR)
+        .filter(
+            Q(search=search_query)
+            | Q(title__icontains=query)
+            | Q(title__trigram_word_similar=query)
+        )
+        .annotate(
+            rank=SearchRank(SEARCH_VECTOR, search_query)
+            + TrigramWordSimilarity(query, "title")
+        )
+        .order_by("-rank", "title", "id")
+    )
+
+    return [(comic, comic.rank) for comic in comics[offset : offset + limit]]
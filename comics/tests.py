@@ -0,0 +1,429 @@
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from django.test import TestCase
+from django.utils import timezone
+from comics.models import Comic, Issue, Page, DownloadJob, DownloadJobStep
+from comics.downloader import (
+    combine_cbz,
+    download_image,
+    image_path,
+    store_in_cache,
+    write_pdf,
+    DOWNLOAD_MAX_THREADS,
+)
+from comics import image_cache
+from comics.jobs import (
+    claim_next_job,
+    process_job,
+    DONE,
+    QUEUED,
+    INCOMPLETE,
+    RUNNING,
+    WORKER_STALE_AFTER,
+)
+import threading
+import tempfile
+import pikepdf
+import zlib
+import os
+
+
+def complete_steps(job, steps):
+    # Stands in for the download engines, which evaluate the steps they're given
+    for step in list(steps):
+        DownloadJobStep.objects.filter(id=step.id).update(complete=True)
+
+
+def write_png(path):
+    # A black 16x16 grayscale PNG, img2pdf rejects smaller pages
+    def chunk(kind, data):
+        body = kind + data
+        return len(data).to_bytes(4, "big") + body + zlib.crc32(body).to_bytes(4, "big")
+
+    with open(path, "wb") as png:
+        png.write(
+            b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", bytes([0, 0, 0, 16, 0, 0, 0, 16, 8, 0, 0, 0, 0]))
+            + chunk(b"IDAT", zlib.compress(bytes(17 * 16)))
+            + chunk(b"IEND", b"")
+        )
+
+
+class ProcessJobTests(TestCase):
+    def setUp(self):
+        comic = Comic.objects.create(
+            title="Comic",
+            link="https://example.com/comic",
+            date_published="2000-01-01",
+            writers="",
+            artists="",
+            number_issues=1,
+        )
+        issue = Issue.objects.create(
+            title="Issue #1",
+            link="https://example.com/comic/issue-1",
+            comic_id=comic,
+            pages=2,
+        )
+        self.job = DownloadJob.objects.create(
+            downloaded_pages=0,
+            total_pages=2,
+            total_issues=1,
+            complete=False,
+            name="job",
+            status=RUNNING,
+        )
+        for number in (1, 2):
+            page = Page.objects.create(
+                issue_id=issue,
+                page_number=number,
+                title="Issue #1",
+                image_link=f"https://example.com/comic/issue-1/{number}.jpg",
+            )
+            DownloadJobStep.objects.create(
+                download_job=self.job,
+                page=page,
+                image_link=page.image_link,
+                page_number=number,
+                issue_index_number=0,
+                complete=False,
+                issue_link=issue.link,
+                retry=False,
+            )
+
+    @mock.patch("comics.jobs.create_folders")
+    @mock.patch("comics.jobs.package")
+    @mock.patch("comics.jobs.run_download", side_effect=complete_steps)
+    def test_packages_job_once_every_step_is_complete(
+        self, run_download, package, create_folders
+    ):
+        process_job(self.job)
+
+        package.assert_called_once_with(self.job)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, DONE)
+        self.assertTrue(self.job.complete)
+
+    @mock.patch("comics.jobs.create_folders")
+    @mock.patch("comics.jobs.package")
+    @mock.patch("comics.jobs.run_download")
+    def test_job_with_steps_left_is_incomplete(
+        self, run_download, package, create_folders
+    ):
+        process_job(self.job)
+
+        package.assert_not_called()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, INCOMPLETE)
+
+    @mock.patch("comics.jobs.create_folders")
+    @mock.patch("comics.jobs.package")
+    @mock.patch("comics.jobs.run_download")
+    def test_job_deleted_while_running(self, run_download, package, create_folders):
+        run_download.side_effect = lambda job, steps: DownloadJob.objects.filter(
+            id=job.id
+        ).delete()
+
+        # Must not raise, the worker keeps running after the job
+        process_job(self.job)
+
+        self.assertFalse(DownloadJob.objects.filter(id=self.job.id).exists())
+
+
+class ClaimNextJobTests(TestCase):
+    def create_job(self, status, heartbeat_at=None):
+        return DownloadJob.objects.create(
+            downloaded_pages=0,
+            total_pages=0,
+            total_issues=0,
+            complete=False,
+            name="job",
+            status=status,
+            claimed_at=heartbeat_at,
+            heartbeat_at=heartbeat_at,
+        )
+
+    def test_reclaims_running_job_without_heartbeat(self):
+        stale = timezone.now() - timedelta(seconds=WORKER_STALE_AFTER + 60)
+        job = self.create_job(RUNNING, heartbeat_at=stale)
+
+        claimed = claim_next_job()
+
+        self.assertEqual(claimed.id, job.id)
+        self.assertGreater(claimed.heartbeat_at, stale)
+
+    def test_leaves_running_job_with_recent_heartbeat(self):
+        self.create_job(RUNNING, heartbeat_at=timezone.now())
+
+        self.assertIsNone(claim_next_job())
+
+
+class CombineCbzTests(TestCase):
+    def setUp(self):
+        comic = Comic.objects.create(
+            title="Comic",
+            link="https://example.com/comic",
+            date_published="2000-01-01",
+            writers="",
+            artists="",
+            number_issues=2,
+        )
+        self.job = DownloadJob.objects.create(
+            downloaded_pages=0,
+            total_pages=2,
+            total_issues=2,
+            complete=False,
+            name="job",
+        )
+        for index in (0, 1):
+            issue = Issue.objects.create(
+                title=f"Issue #{index + 1}",
+                link=f"https://example.com/comic/issue-{index + 1}",
+                comic_id=comic,
+                pages=1,
+            )
+            page = Page.objects.create(
+                issue_id=issue,
+                page_number=1,
+                title=issue.title,
+                image_link=f"{issue.link}/1.jpg",
+            )
+            DownloadJobStep.objects.create(
+                download_job=self.job,
+                page=page,
+                image_link=page.image_link,
+                page_number=1,
+                issue_index_number=index,
+                complete=False,
+                issue_link=issue.link,
+                retry=False,
+            )
+
+    def test_per_issue_archives_keep_their_titles_when_an_issue_has_no_images(self):
+        with tempfile.TemporaryDirectory() as base_folder:
+            # Same layout as create_folders, the first issue has no images
+            folder = f"{base_folder}\\{self.job.id}"
+            for index in (0, 1):
+                os.makedirs(os.path.join(folder, str(index)))
+            with open(os.path.join(folder, "1", "1.png"), "wb") as image:
+                image.write(b"png")
+
+            with mock.patch("comics.downloader.DOWNLOAD_BASE_FOLDER", base_folder):
+                result = combine_cbz(self.job, per_issue=True)
+
+        self.assertEqual(result["files"], ["002 - Issue #2.cbz"])
+
+
+class WritePdfTests(TestCase):
+    @mock.patch("comics.downloader.COMBINE_MERGE_CHUNK_SIZE", 2)
+    def test_joins_more_issues_than_the_merge_chunk_size(self):
+        with tempfile.TemporaryDirectory() as folder:
+            issues = []
+            for index in range(5):
+                image_path = os.path.join(folder, f"{index}.png")
+                write_png(image_path)
+                issues.append([image_path])
+
+            output_path = os.path.join(folder, "job.pdf")
+            write_pdf(issues, output_path)
+
+            with pikepdf.open(output_path) as pdf:
+                self.assertEqual(len(pdf.pages), 5)
+            # Only the images and the PDF are left
+            self.assertEqual(len(os.listdir(folder)), 6)
+
+
+class DownloadJobOptionsTests(TestCase):
+    def setUp(self):
+        self.job = DownloadJob.objects.create(
+            downloaded_pages=0,
+            total_pages=0,
+            total_issues=0,
+            complete=False,
+            name="job",
+            status=INCOMPLETE,
+        )
+
+    def retry(self, data):
+        return self.client.post(
+            f"/comics/retry_download_job/{self.job.id}",
+            data,
+            content_type="application/json",
+        )
+
+    def test_rejects_threads_out_of_range(self):
+        for threads in (0, -1, DOWNLOAD_MAX_THREADS + 1, "many", True, 2.5):
+            with self.subTest(threads=threads):
+                self.assertEqual(self.retry({"threads": threads}).status_code, 400)
+
+                response = self.client.post(
+                    "/comics/create_and_start_download",
+                    {"issue_ids": [], "name": "job", "threads": threads},
+                    content_type="application/json",
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("threads", response.json()["error"])
+
+    def test_retry_sets_threads(self):
+        self.assertEqual(self.retry({"threads": 8}).status_code, 202)
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.threads, 8)
+
+    def test_parses_adaptive(self):
+        for adaptive, expected in ((False, False), ("false", False), ("True", True)):
+            with self.subTest(adaptive=adaptive):
+                self.assertEqual(self.retry({"adaptive": adaptive}).status_code, 202)
+
+                self.job.refresh_from_db()
+                self.assertIs(self.job.adaptive, expected)
+                DownloadJob.objects.filter(id=self.job.id).update(status=INCOMPLETE)
+
+    def test_rejects_adaptive_that_is_not_a_boolean(self):
+        for adaptive in ("no", 1, None):
+            with self.subTest(adaptive=adaptive):
+                self.assertEqual(self.retry({"adaptive": adaptive}).status_code, 400)
+
+
+class DeleteCompletedDownloadJobsTests(TestCase):
+    def test_keeps_a_retried_job(self):
+        job = DownloadJob.objects.create(
+            downloaded_pages=0,
+            total_pages=0,
+            total_issues=0,
+            complete=True,
+            name="job",
+            status=DONE,
+        )
+        response = self.client.post(
+            f"/comics/retry_download_job/{job.id}",
+            {"output_format": "cbz"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 202)
+
+        self.client.delete("/comics/delete_completed_download_jobs")
+
+        job.refresh_from_db()
+        self.assertFalse(job.complete)
+        self.assertEqual(job.status, QUEUED)
+
+
+class ImageCacheTests(TestCase):
+    def test_concurrent_stores_of_the_same_blob(self):
+        with tempfile.TemporaryDirectory() as folder:
+            source = os.path.join(folder, "image.png")
+            write_png(source)
+            destination = os.path.join(folder, "blob")
+            errors = []
+
+            def store():
+                try:
+                    for _ in range(50):
+                        image_cache.link_or_copy(source, destination)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=store) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(errors, [])
+            self.assertEqual(sorted(os.listdir(folder)), ["blob", "image.png"])
+
+    @mock.patch("comics.image_cache.store", side_effect=OSError("No space left"))
+    @mock.patch("comics.image_cache.enabled", return_value=True)
+    def test_failing_store_does_not_raise(self, enabled, store):
+        step = DownloadJobStep(image_link="https://example.com/1.jpg")
+
+        store_in_cache(step, "1.png")
+
+        store.assert_called_once()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    # Serves IMAGE with a strong ETag, like a real server it sends a range unless
+    # If-Range doesn't match
+    etag = '"v2"'
+    ranges = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        range_header = self.headers.get("Range")
+        self.ranges.append(range_header)
+
+        if range_header and self.headers.get("If-Range", self.etag) == self.etag:
+            offset = int(range_header[len("bytes=") : -1])
+            body = IMAGE[offset:]
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {offset}-{len(IMAGE) - 1}/{len(IMAGE)}"
+            )
+        else:
+            body = IMAGE
+            self.send_response(200)
+
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+IMAGE = b"the image as it is now"
+
+
+class ResumeDownloadTests(TestCase):
+    def setUp(self):
+        self.handler = type("Handler", (ImageHandler,), {"ranges": []})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        base_folder = tempfile.TemporaryDirectory()
+        self.addCleanup(base_folder.cleanup)
+        patcher = mock.patch("comics.downloader.DOWNLOAD_BASE_FOLDER", base_folder.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.job = DownloadJob(id=1, name="job")
+        self.step = DownloadJobStep(
+            image_link=f"http://127.0.0.1:{server.server_port}/1.jpg",
+            page_number=1,
+            issue_index_number=0,
+        )
+        self.save_path = image_path(self.job, self.step)
+        # Same layout as create_folders
+        os.makedirs(f"{base_folder.name}\\{self.job.id}\\0")
+
+    def download(self, partial, validator):
+        part_path = self.save_path + ".part"
+        with open(part_path, "wb") as file:
+            file.write(partial)
+        if validator:
+            with open(part_path + ".validator", "w") as file:
+                file.write(validator)
+
+        with mock.patch("comics.image_cache.enabled", return_value=False):
+            self.assertTrue(download_image(self.job, self.step, mock.Mock()))
+
+        with open(self.save_path, "rb") as file:
+            return file.read()
+
+    def test_resumes_when_the_image_is_unchanged(self):
+        self.assertEqual(self.download(IMAGE[:7], '"v2"'), IMAGE)
+        self.assertEqual(self.handler.ranges, ["bytes=7-"])
+
+    def test_downloads_the_whole_image_when_it_changed(self):
+        self.assertEqual(self.download(b"the old", '"v1"'), IMAGE)
+
+    def test_downloads_the_whole_image_without_a_validator(self):
+        self.assertEqual(self.download(b"the old", None), IMAGE)
+        self.assertEqual(self.handler.ranges, [None])
+        self.assertFalse(os.path.exists(self.save_path + ".part"))
+        self.assertFalse(os.path.exists(self.save_path + ".part.validator"))
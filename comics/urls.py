@@ -17,7 +17,9 @@ urlpatterns = [
     path("delete_issues_by_comic_link", views.delete_issues_by_comic_link),
     path("create_and_start_download", views.create_and_start_download),
     path("retry_download_job/<int:job_id>", views.retry_download_job),
+    path("cancel_download_job/<int:job_id>", views.cancel_download_job),
     path("get_all_download_jobs", views.get_all_download_jobs),
     path("delete_download_job/<int:job_id>", views.delete_download_job),
     path("delete_completed_download_jobs", views.delete_completed_download_jobs),
+    path("get_image_cache_stats", views.get_image_cache_stats),
 ]
@@ -1,3 +1,4 @@
+import unicodedata
 import re
 import os
 
@@ -12,6 +13,8 @@ def comic_to_json(comic):
         "artists": comic.artists,
         "number_issues": comic.number_issues,
         "last_updated": comic.last_updated,
+        "status": comic.status,
+        "last_refreshed": comic.last_refreshed,
     }
 
 
@@ -20,7 +23,7 @@ def issue_to_json(issue):
         "id": issue.id,
         "title": issue.title,
         "link": issue.link,
-        "comic_id": issue.comic_id.id,
+        "comic_id": issue.comic_id_id,
         "pages": issue.pages,
     }
 
@@ -41,6 +44,17 @@ def download_job_to_json(job):
         "total_issues": job.total_issues,
         "complete": job.complete,
         "name": job.name,
+        "threads": job.threads,
+        "adaptive": job.adaptive,
+        "settled_concurrency": job.settled_concurrency,
+        "engine": job.engine,
+        "status": job.status,
+        "output_format": job.output_format,
+        "cache_hits": job.cache_hits,
+        "cache_misses": job.cache_misses,
+        "combine_seconds": job.combine_seconds,
+        "combine_peak_rss_kb": job.combine_peak_rss_kb,
+        "planning_seconds": job.planning_seconds,
     }
 
 
@@ -94,5 +108,33 @@ def sanitize_filename(filename: str, replacement: str = "_") -> str:
     return cleaned_filename
 
 
+# Runs of digits in a title, compared as numbers by natural_sort_key
+NUMBER_PATTERN = re.compile(r"(\d+)")
+
+
+def natural_sort_key(title: str) -> bytes:
+    """
+    Returns a key that orders titles the same way as natsort's natsorted, as bytes so
+    the database compares it byte by byte whatever its collation.
+
+    The title is split into text and numbers. Text is encoded as UTF-8 and ends with a
+    0 byte, so shorter text sorts first. Numbers are prefixed with their digit count,
+    so longer numbers sort after shorter ones.
+    """
+    key = bytearray()
+
+    # natsort compares decomposed unicode, e.g. "É" as "E" and an accent
+    title = unicodedata.normalize("NFD", title)
+
+    for index, part in enumerate(NUMBER_PATTERN.split(title)):
+        if index % 2 == 0:
+            key += part.encode() + b"\x00"
+        else:
+            digits = str(int(part))
+            key += bytes([len(digits)]) + digits.encode()
+
+    return bytes(key)
+
+
 if __name__ == "__main__":
     print(create_date("1111"))
@@ -1,16 +1,18 @@
-from typing import List
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from .utils import *
-from .models import Comic, Issue, Page, DownloadJob, DownloadJobStep
+from .models import Comic, Issue, Page, DownloadJob, DownloadJobStep, CachedImage
+from django.db import transaction
+from django.db.models import Max, Sum
 from django.shortcuts import get_object_or_404
 from .downloader import (
-    download_images,
-    create_folders,
+    DOWNLOAD_ENGINES,
+    DOWNLOAD_MAX_THREADS,
+    OUTPUT_FORMATS,
     recursive_remove_folder,
-    combine,
 )
-from natsort import natsorted
+from .search import find_comics, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT
+from .jobs import enqueue_job, plan_job, QUEUED, RUNNING, INCOMPLETE
 
 
 @api_view(["GET"])
@@ -50,16 +52,7 @@ def get_issues_for_comic(request, comic_id):
     # Retrieve the comic by its ID
     comic = get_object_or_404(Comic, id=comic_id)
 
-    # Retrieve all issues related to the comic
-    issues = Issue.objects.filter(comic_id=comic)
-
-    # Prepare the list of issues
-    issue_list = [issue_to_json(issue) for issue in issues]
-    issue_list = natsorted(issue_list, key=lambda c: c["title"], reverse=True)
-    # issue_list = sorted(issue_list, key=lambda c: c['title'])
-
-    # Return the list of issues for the comic
-    return Response(issue_list)
+    return issues_response(request, comic)
 
 
 @api_view(["GET"])
@@ -68,13 +61,33 @@ def get_issues_by_link(request):
     # Retrieve the comic by its ID
     comic = get_object_or_404(Comic, link=url)
 
-    # Retrieve all issues related to the comic
-    issues = Issue.objects.filter(comic_id=comic)
+    return issues_response(request, comic)
+
+
+def issues_response(request, comic):
+    """
+    Returns the comic's issues in reverse natural order of their titles, optionally
+    paginated with the limit and offset query parameters.
+    """
+    # Ordered in the database by the stored natural sort key, ties in creation order
+    issues = Issue.objects.filter(comic_id=comic).order_by("-sort_key", "id")
+
+    try:
+        offset = int(request.GET.get("offset", 0))
+        limit = request.GET.get("limit")
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        return Response({"error": "limit and offset must be integers."}, status=400)
+
+    if offset < 0 or (limit is not None and limit < 1):
+        return Response(
+            {"error": "limit must be at least 1, offset at least 0."}, status=400
+        )
+
+    issues = issues[offset : offset + limit] if limit else issues[offset:]
 
     # Prepare the list of issues
     issue_list = [issue_to_json(issue) for issue in issues]
-    issue_list = natsorted(issue_list, key=lambda c: c["title"], reverse=True)
-    # issue_list = sorted(issue_list, key=lambda c: c['title'])
 
     # Return the list of issues for the comic
     return Response(issue_list)
@@ -148,13 +161,23 @@ def search_comics(request):
     if not title_query:
         return Response({"error": "No title query provided."}, status=400)
 
-    # Filter comics by the title (case-insensitive search)
-    comics = Comic.objects.filter(title__icontains=title_query)
+    try:
+        limit = int(request.GET.get("limit", SEARCH_DEFAULT_LIMIT))
+        offset = int(request.GET.get("offset", 0))
+    except ValueError:
+        return Response({"error": "limit and offset must be integers."}, status=400)
 
-    # Prepare the results to return as JSON
-    comic_list = [comic_to_json(comic) for comic in comics]
+    if limit < 1 or limit > SEARCH_MAX_LIMIT or offset < 0:
+        return Response(
+            {"error": f"limit must be 1 to {SEARCH_MAX_LIMIT}, offset at least 0."},
+            status=400,
+        )
 
-    comic_list = sorted(comic_list, key=lambda c: c["title"])
+    # Best matches first, see comics.search
+    results = find_comics(title_query, limit=limit, offset=offset)
+
+    # Prepare the results to return as JSON
+    comic_list = [{**comic_to_json(comic), "rank": rank} for comic, rank in results]
 
     return Response(comic_list)
 
@@ -257,101 +280,163 @@ def update_comic(request, comic_id):
         return Response({"error": str(e)}, status=500)
 
 
+def parse_threads(threads):
+    """
+    Returns threads as an int, or None if it isn't set. Raises ValueError unless it's a
+    whole number from 1 to DOWNLOAD_MAX_THREADS.
+    """
+    if threads is None:
+        return None
+
+    # JSON booleans are ints to Python, and int() would truncate floats
+    if isinstance(threads, (bool, float)):
+        raise ValueError
+
+    threads = int(threads)
+    if threads < 1 or threads > DOWNLOAD_MAX_THREADS:
+        raise ValueError
+
+    return threads
+
+
+def parse_adaptive(adaptive):
+    """
+    Returns adaptive as a bool. Form and query input is text, so "true" and "false"
+    are accepted as well as JSON booleans. Raises ValueError on anything else.
+    """
+    if isinstance(adaptive, bool):
+        return adaptive
+
+    if isinstance(adaptive, str) and adaptive.lower() in ("true", "false"):
+        return adaptive.lower() == "true"
+
+    raise ValueError
+
+
 @api_view(["POST"])
 def create_and_start_download(request):
     data = request.data
     issue_ids = data["issue_ids"]
     name = data["name"]
+    threads = data.get("threads")
+    adaptive = data.get("adaptive", False)
+    engine = data.get("engine", "threaded")
+    output_format = data.get("output_format", "pdf")
+
+    if engine not in DOWNLOAD_ENGINES:
+        return Response({"error": f"Unknown download engine: {engine}"}, status=400)
+
+    try:
+        threads = parse_threads(threads)
+    except (TypeError, ValueError):
+        return Response(
+            {"error": f"threads must be 1 to {DOWNLOAD_MAX_THREADS}."},
+            status=400,
+        )
+
+    try:
+        adaptive = parse_adaptive(adaptive)
+    except ValueError:
+        return Response({"error": "adaptive must be true or false."}, status=400)
+
+    if output_format not in OUTPUT_FORMATS:
+        return Response(
+            {"error": f"Unknown output format: {output_format}"}, status=400
+        )
 
-    steps: List[DownloadJobStep] = []
+    try:
+        issue_ids = [int(issue_id) for issue_id in issue_ids]
+    except (TypeError, ValueError):
+        return Response({"error": "Issue ids must be integers."}, status=400)
 
     downloaded_pages = 0
     total_pages = 0
     total_issues = 0
     complete = False
     try:
-        download_job = DownloadJob.objects.create(
-            downloaded_pages=downloaded_pages,
-            total_pages=total_pages,
-            total_issues=total_issues,
-            complete=complete,
-            name=name,
-        )
+        # The job only exists if all of its steps could be planned
+        with transaction.atomic():
+            download_job = DownloadJob.objects.create(
+                downloaded_pages=downloaded_pages,
+                total_pages=total_pages,
+                total_issues=total_issues,
+                complete=complete,
+                name=name,
+                threads=threads,
+                adaptive=adaptive,
+                engine=engine,
+                output_format=output_format,
+            )
+            plan_job(download_job, issue_ids)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
     except Exception as e:
         # If there was an error with the request, send an error response
         return Response({"error failed to create download job": str(e)}, status=500)
 
-    issue_index = 0
+    # The download worker picks the job up, progress can be followed with the job's fields
+    enqueue_job(download_job)
 
-    total_pages = 0
+    return Response(download_job_to_json(download_job), status=202)
 
-    for issue_id in issue_ids:
 
-        issue = Issue.objects.get(id=issue_id)
+@api_view(["POST"])
+def retry_download_job(request, job_id):
+    download_job = get_object_or_404(DownloadJob, id=job_id)
 
-        pages = Page.objects.filter(issue_id=issue)
+    if download_job.status in (QUEUED, RUNNING):
+        return Response({"error": "Download job is already queued."}, status=409)
 
-        for page in pages:
+    threads = request.data.get("threads")
+    engine = request.data.get("engine")
+    output_format = request.data.get("output_format")
 
-            download_job_step = DownloadJobStep.objects.create(
-                download_job=download_job,
-                page=page,
-                image_link=page.image_link,
-                page_number=page.page_number,
-                issue_index_number=issue_index,
-                complete=False,
-                issue_link=issue.link,
-                retry=False,
-            )
+    if engine and engine not in DOWNLOAD_ENGINES:
+        return Response({"error": f"Unknown download engine: {engine}"}, status=400)
 
-            total_pages += 1
+    try:
+        threads = parse_threads(threads)
+    except (TypeError, ValueError):
+        return Response(
+            {"error": f"threads must be 1 to {DOWNLOAD_MAX_THREADS}."},
+            status=400,
+        )
 
-            steps.append(download_job_step)
+    if output_format and output_format not in OUTPUT_FORMATS:
+        return Response(
+            {"error": f"Unknown output format: {output_format}"}, status=400
+        )
 
-        issue_index += 1
+    if "adaptive" in request.data:
+        try:
+            download_job.adaptive = parse_adaptive(request.data["adaptive"])
+        except ValueError:
+            return Response({"error": "adaptive must be true or false."}, status=400)
 
-    download_job.total_pages = total_pages
-    download_job.total_issues = issue_index
+    download_job.threads = threads or download_job.threads
+    download_job.engine = engine or download_job.engine
+    download_job.output_format = output_format or download_job.output_format
     download_job.save()
 
-    create_folders(download_job)
-    download_images(download_job, steps)
+    enqueue_job(download_job)
 
-    # Update the job if no more things to download.
-    incomplete_steps = DownloadJobStep.objects.filter(
-        download_job_id=download_job.id, complete=False
-    )
-    if not incomplete_steps:
-        download_job.complete = True
-        download_job.save()
-        combine(download_job)
-
-        return Response(download_job_to_json(download_job), status=200)
-    else:
-        return Response({"error": "Download job is not complete"}, status=200)
+    return Response(download_job_to_json(download_job), status=202)
 
 
 @api_view(["POST"])
-def retry_download_job(request, job_id):
-    download_job = DownloadJob.objects.get(id=job_id)
-    incomplete_steps = DownloadJobStep.objects.filter(
-        download_job_id=job_id, complete=False
-    )
-
-    create_folders(download_job)
-    download_images(download_job, incomplete_steps)
-
-    # Update the job if no more things to download.
-    incomplete_steps = DownloadJobStep.objects.filter(
-        download_job_id=download_job.id, complete=False
-    )
-    if not incomplete_steps:
-        download_job.complete = True
-        download_job.save()
-        combine(download_job)
-        return Response({"message": "ok"}, status=200)
+def cancel_download_job(request, job_id):
+    download_job = get_object_or_404(DownloadJob, id=job_id)
+
+    if download_job.status == QUEUED:
+        # Not claimed by a worker yet, take it off the queue
+        DownloadJob.objects.filter(id=job_id, status=QUEUED).update(status=INCOMPLETE)
+    elif download_job.status == RUNNING:
+        # Picked up by the worker on its next progress flush
+        DownloadJob.objects.filter(id=job_id).update(cancel_requested=True)
     else:
-        return Response({"error": "Download job is not complete"}, status=200)
+        return Response({"error": "Download job is not running."}, status=404)
+
+    return Response({"message": "Download job cancelled."}, status=200)
 
 
 @api_view(["GET"])
@@ -373,6 +458,12 @@ def delete_download_job(request, job_id):
     try:
         download_job = get_object_or_404(DownloadJob, id=job_id)
 
+        if download_job.status == RUNNING:
+            # The worker is still writing to the job's folder
+            return Response(
+                {"error": "Download job is running, cancel it first."}, status=409
+            )
+
         DownloadJobStep.objects.filter(download_job=download_job).delete()
         recursive_remove_folder(download_job)
         download_job.delete()
@@ -386,7 +477,10 @@ def delete_download_job(request, job_id):
 @api_view(["DELETE"])
 def delete_completed_download_jobs(request):
     try:
-        completed_jobs = DownloadJob.objects.filter(complete=True)
+        # Queued and running jobs are being written to by the worker, leave them alone
+        completed_jobs = DownloadJob.objects.filter(complete=True).exclude(
+            status__in=(QUEUED, RUNNING)
+        )
 
         if not completed_jobs.exists():
             return Response({"message": "No completed jobs."}, status=200)
@@ -404,3 +498,27 @@ def delete_completed_download_jobs(request):
 
     except Exception as e:
         return Response({"error": str(e)}, status=500)
+
+
+@api_view(["GET"])
+def get_image_cache_stats(request):
+    # Links with identical images share one file, count each file once
+    files = CachedImage.objects.values("content_hash").annotate(size=Max("size"))
+    jobs = DownloadJob.objects.aggregate(
+        hits=Sum("cache_hits"), misses=Sum("cache_misses")
+    )
+
+    hits = jobs["hits"] or 0
+    misses = jobs["misses"] or 0
+
+    return Response(
+        {
+            "images": CachedImage.objects.count(),
+            "files": len(files),
+            "size": sum(file["size"] for file in files),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+        },
+        status=200,
+    )
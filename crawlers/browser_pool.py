@@ -0,0 +1,124 @@
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.service import Service
+from dotenv import load_dotenv
+import threading
+import atexit
+import os
+
+load_dotenv()
+
+# Number of Chrome instances crawling issues at the same time
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", 2))
+# A browser is replaced with a fresh one after crawling this many pages
+BROWSER_MAX_PAGES = int(os.getenv("BROWSER_MAX_PAGES", 50))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def create_browser():
+    chrome_options = webdriver.ChromeOptions()
+    chrome_options.add_argument("--incognito")
+    # chrome_options.add_argument('--start-minimized')
+
+    service = Service(os.getenv("CHROME_DRIVER_PATH"))
+    return webdriver.Chrome(service=service, options=chrome_options)
+
+
+def is_healthy(browser):
+    try:
+        return browser.execute_script("return 1;") == 1
+    except WebDriverException:
+        return False
+
+
+def quit_browser(browser):
+    try:
+        browser.quit()
+    except WebDriverException:
+        pass
+
+
+class BrowserPool:
+    """
+    Keeps up to size Chrome instances alive between crawls. Browsers are started on
+    first use, checked before every page, and replaced after max_pages pages or when
+    they crash.
+
+    Usage:
+        with get_browser_pool().browser() as browser:
+            browser.get(url)
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES):
+        self.size = size
+        self.max_pages = max_pages
+
+        # [browser, pages crawled] for every browser that isn't in use
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(size)
+
+    @contextmanager
+    def browser(self):
+        self._slots.acquire()
+
+        try:
+            entry = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        healthy = True
+        try:
+            yield entry[0]
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            entry[1] += 1
+            self._checkin(entry, healthy)
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for browser, _ in idle:
+            quit_browser(browser)
+
+    def _checkout(self):
+        with self._lock:
+            entry = self._idle.pop() if self._idle else None
+
+        if entry is not None and is_healthy(entry[0]):
+            return entry
+
+        if entry is not None:
+            quit_browser(entry[0])
+
+        return [create_browser(), 0]
+
+    def _checkin(self, entry, healthy):
+        if not healthy or entry[1] >= self.max_pages:
+            quit_browser(entry[0])
+            return
+
+        with self._lock:
+            self._idle.append(entry)
+
+
+def get_browser_pool():
+    """
+    Returns the browser pool shared by all crawls in this process.
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+            atexit.register(_pool.close)
+
+    return _pool
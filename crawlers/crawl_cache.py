@@ -0,0 +1,55 @@
+from scrapy.extensions.httpcache import RFC2616Policy
+from email.utils import formatdate
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+# Seconds a cached page is used without asking the server, after that it's revalidated
+CRAWL_CACHE_TTL = int(os.getenv("CRAWL_CACHE_TTL", 6 * 60 * 60))
+# Folder of the cache, relative paths are inside the project's .scrapy folder
+CRAWL_CACHE_DIR = os.getenv("CRAWL_CACHE_DIR", "httpcache")
+
+
+class TTLPolicy(RFC2616Policy):
+    """
+    RFC 2616 caching where pages without an explicit max-age or Expires are fresh for
+    CRAWL_CACHE_TTL seconds, instead of the heuristic based on Last-Modified. Stale
+    pages are revalidated with If-None-Match / If-Modified-Since and a 304 response
+    reuses the cached page, stale pages without ETag or Last-Modified are fetched again.
+
+    RFC2616Policy only stores 200 responses that have a validator, this also stores
+    the ones without, so the TTL covers every info page.
+    """
+
+    def should_cache_response(self, response, request):
+        if not super().should_cache_response(response, request):
+            if response.status != 200:
+                return False
+            if b"no-store" in self._parse_cachecontrol(response):
+                return False
+
+        # The age of a cached page is taken from its Date, without one it would never
+        # get stale
+        if b"Date" not in response.headers:
+            response.headers[b"Date"] = formatdate(usegmt=True)
+
+        return True
+
+    def _compute_freshness_lifetime(self, response, request, now):
+        cache_control = self._parse_cachecontrol(response)
+        if b"max-age" in cache_control or b"Expires" in response.headers:
+            return super()._compute_freshness_lifetime(response, request, now)
+
+        return CRAWL_CACHE_TTL
+
+
+# Scrapy settings for spiders that use the crawl cache
+CRAWL_CACHE_SETTINGS = {
+    "HTTPCACHE_ENABLED": True,
+    "HTTPCACHE_POLICY": "crawlers.crawl_cache.TTLPolicy",
+    "HTTPCACHE_STORAGE": "scrapy.extensions.httpcache.FilesystemCacheStorage",
+    "HTTPCACHE_DIR": CRAWL_CACHE_DIR,
+    # Entries never expire in storage, TTLPolicy decides when to revalidate them
+    "HTTPCACHE_EXPIRATION_SECS": 0,
+}
@@ -1,13 +1,16 @@
 import scrapy
-from scrapy.crawler import CrawlerRunner
-from scrapy.utils.project import get_project_settings
-from multiprocessing import Process, Queue
-from twisted.internet import reactor
-from bs4 import BeautifulSoup
-
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
+from parsel import Selector
+
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from crawlers.browser_pool import get_browser_pool
+from crawlers.spider_service import get_spider_service
+from crawlers.crawl_cache import CRAWL_CACHE_SETTINGS
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import requests
+import hashlib
 import time
+import re
 
 from dotenv import load_dotenv
 import os
@@ -17,13 +20,28 @@ load_dotenv()
 
 class InfoPageSpider(scrapy.Spider):
     name = "InfoPageSpider"
+    # Info pages are cached on disk and revalidated, see crawlers.crawl_cache
+    custom_settings = CRAWL_CACHE_SETTINGS
 
-    def __init__(self, urls, *args, **kwargs):
+    def __init__(self, urls, known_hashes=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.start_urls = urls if isinstance(urls, list) else [urls]
+        # content hashes of the pages as they were last ingested, by link
+        self.known_hashes = known_hashes or {}
 
     def parse(self, response):
-        result = {"link": response.url}
+        content_hash = hashlib.sha256(response.body).hexdigest()
+
+        # Nothing to parse if the page is the same as the last time it was ingested
+        if self.known_hashes.get(response.url) == content_hash:
+            yield {
+                "link": response.url,
+                "content_hash": content_hash,
+                "unchanged": True,
+            }
+            return
+
+        result = {"link": response.url, "content_hash": content_hash}
 
         title = response.css("div.heading h3::text").get()
         if title:
@@ -41,6 +59,8 @@ class InfoPageSpider(scrapy.Spider):
                 element_name = "artists"
             elif "date" in paragraph_text.lower():
                 element_name = "date_published"
+            elif "status" in paragraph_text.lower():
+                element_name = "status"
 
             if not element_name:
                 continue
@@ -70,111 +90,293 @@ class InfoPageSpider(scrapy.Spider):
         yield result
 
 
-def f(q, urls, selected_spider):  # Define f as a global function
-    try:
-        results = []
-
-        def item_scraped(item, response, spider):
-            results.append(item)
-
-        settings = get_project_settings()
-        settings["LOG_LEVEL"] = "ERROR"
-        runner = CrawlerRunner(settings)
-        crawler = runner.create_crawler(selected_spider)
-        crawler.signals.connect(item_scraped, signal=scrapy.signals.item_scraped)
-        deferred = runner.crawl(crawler, urls=urls)
-        deferred.addBoth(lambda _: reactor.stop())
-        reactor.run(installSignalHandlers=False)
-        q.put(results)
-    except Exception as e:
-        q.put(e)
-
-
-def run_spider(urls, selected_spider):
+def run_spider(urls, selected_spider, **spider_kwargs):
     """
-    Runs the specified spider with the given URLs in a separate process and returns the results.
+    Runs the specified spider with the given URLs in the long-lived crawler process and returns the results.
 
     Args:
         urls: A list of URLs to crawl.
         selected_spider: The spider class to use for crawling.
+        settings: Optional Scrapy settings for this crawl only, e.g. DOWNLOAD_DELAY.
 
     Returns:
         A list of dictionaries, where each dictionary represents the results from a crawled page.
     """
+    return get_spider_service().crawl(urls, selected_spider, **spider_kwargs)
 
-    q = Queue()
-    p = Process(target=f, args=(q, urls, selected_spider))  # Now uses the global f
-    p.start()
-    result = q.get()
-    p.join()
 
-    if isinstance(result, Exception):
-        raise result
-    else:
-        return result
+def stream_spider(urls, selected_spider, **spider_kwargs):
+    """
+    Runs the specified spider like run_spider, but yields every result as soon as it's
+    scraped instead of waiting for the whole crawl.
+
+    Raises:
+        CrawlError: If the crawl fails. Results yielded before the failure are kept.
+    """
+    yield from get_spider_service().stream(urls, selected_spider, **spider_kwargs)
 
 
 def crawl_issues(issues):
+    """
+    Crawls the issues' reader pages in parallel. Each page is first fetched over plain
+    HTTP, the shared browser pool is only used when that doesn't find the images.
+
+    Returns:
+        A list of successes with the crawled pages and a list of failures, both in the
+        order of issues.
+    """
     print(issues)
-    chrome_options = webdriver.ChromeOptions()
-    chrome_options.add_argument("--incognito")
-    # chrome_options.add_argument('--start-minimized')
+    pool = get_browser_pool()
+
+    def crawl(issue):
+        if CRAWL_HTTP_FAST_PATH:
+            result = timed_crawl("http", lambda: http_crawl(issue["link"]))
+            if "error" not in result:
+                return result
 
-    service = Service(os.getenv("CHROME_DRIVER_PATH"))
-    browser = webdriver.Chrome(service=service, options=chrome_options)
-    # browser.minimize_window()
+        def crawl_with_browser():
+            try:
+                with pool.browser() as browser:
+                    return selenium_crawl(browser, issue["link"])
+            except WebDriverException as e:
+                return {"error": str(e)}
+
+        return timed_crawl("selenium", crawl_with_browser)
+
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        results = list(executor.map(crawl, issues))
 
     successes = []
     failures = []
 
-    for issue in issues:
-        result = selenium_crawl(browser, issue["link"])
-
+    for issue, result in zip(issues, results):
         if "error" in result:
             failures.append({"issue_id": issue["issue_id"], "link": issue["link"]})
         else:
             successes.append(
-                {"issue_id": issue["issue_id"], "pages": result, "link": issue["link"]}
+                {
+                    "issue_id": issue["issue_id"],
+                    "pages": result["pages"],
+                    "link": issue["link"],
+                    "crawl_path": result["crawl_path"],
+                    "wait_seconds": result.get("wait_seconds", 0),
+                    "wait_strategy": result.get("wait_strategy"),
+                }
             )
 
-    browser.quit()
-
     return successes, failures
 
 
-def selenium_crawl(browser, url, image_load_threshold=120):
+# Try to read the image links of reader pages without a browser first
+CRAWL_HTTP_FAST_PATH = os.getenv("CRAWL_HTTP_FAST_PATH", "true").lower() == "true"
+
+# Image links in the reader page's inline scripts, e.g. lstImages.push("https://...")
+INLINE_IMAGE_PATTERN = re.compile(r"lstImages\.push\(\s*[\"']([^\"']+)[\"']\s*\)")
+
+_http_session = requests.Session()
+_http_session.headers["User-Agent"] = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+)
+
+# Attempts, successes and seconds spent per crawl path, see crawl_stats
+_crawl_stats = {
+    "http": {"attempts": 0, "successes": 0, "seconds": 0.0},
+    "selenium": {"attempts": 0, "successes": 0, "seconds": 0.0},
+}
+_crawl_stats_lock = threading.Lock()
+
+
+def http_crawl(url):
+    """
+    Reads an issue's image links from the reader page's HTML, either from img tags that
+    already have their src or from the inline script that lists the images.
+
+    Returns:
+        A dictionary with the pages, or a dictionary with an error.
+    """
+    try:
+        response = _http_session.get(url, timeout=30)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        return {"error": str(e)}
+
+    links = image_sources_from_html(response.text)
+    if not links or any(not src or "blank.gif" in src for src in links):
+        links = INLINE_IMAGE_PATTERN.findall(response.text)
+
+    if not links:
+        return {"error": "Was not able to find images without a browser for: " + url}
+
+    return {
+        "pages": [{"page": index + 1, "link": link} for index, link in enumerate(links)]
+    }
+
+
+def image_sources_from_html(html):
+    """
+    Returns the src of every reader image in the page, in page order. Images without a
+    src are None.
+    """
+    # parsel parses with lxml, much faster than BeautifulSoup's html.parser
+    images = Selector(text=html).xpath('//img[@rel="noreferrer"]')
+    return [img.attrib.get("src") for img in images]
+
+
+def timed_crawl(path, crawl):
+    start_time = time.perf_counter()
+    result = crawl()
+    seconds = time.perf_counter() - start_time
+
+    with _crawl_stats_lock:
+        stats = _crawl_stats[path]
+        stats["attempts"] += 1
+        stats["seconds"] += seconds
+        if "error" not in result:
+            stats["successes"] += 1
+
+    result["crawl_path"] = path
+    return result
+
+
+def crawl_stats():
+    """
+    Returns the success rate and average latency of each crawl path in this process.
+    """
+    with _crawl_stats_lock:
+        stats = {path: dict(values) for path, values in _crawl_stats.items()}
+
+    for values in stats.values():
+        attempts = values["attempts"]
+        values["success_rate"] = values["successes"] / attempts if attempts else None
+        values["average_seconds"] = values["seconds"] / attempts if attempts else None
+
+    return stats
+
+
+# Resolves once every reader image has a real src. Lazy loaders fill in images as they
+# come into view, so the first unloaded image is scrolled into view after every change.
+WAIT_FOR_IMAGES_SCRIPT = """
+const graceSeconds = arguments[0];
+const done = arguments[arguments.length - 1];
+
+function unloaded() {
+    const images = Array.from(document.querySelectorAll('img[rel="noreferrer"]'));
+    if (images.length === 0) {
+        return null;
+    }
+    return images.filter((img) => {
+        const src = img.getAttribute("src");
+        return !src || src.includes("blank.gif");
+    });
+}
+
+function check() {
+    const images = unloaded();
+    if (images === null) {
+        return;
+    }
+    if (images.length === 0) {
+        observer.disconnect();
+        done(true);
+        return;
+    }
+    images[0].scrollIntoView();
+}
+
+const observer = new MutationObserver(check);
+observer.observe(document.body, {
+    subtree: true,
+    childList: true,
+    attributes: true,
+    attributeFilter: ["src"],
+});
+check();
+
+// Error and challenge pages never get reader images, don't wait the full timeout
+setTimeout(() => {
+    if (unloaded() === null) {
+        observer.disconnect();
+        done(false);
+    }
+}, graceSeconds * 1000);
+"""
+
+# The src of every reader image, in page order
+READ_IMAGE_SOURCES_SCRIPT = """
+return Array.from(
+    document.querySelectorAll('img[rel="noreferrer"]'),
+    (img) => img.getAttribute("src")
+);
+"""
+
+# Seconds WAIT_FOR_IMAGES_SCRIPT waits for the first reader image to show up
+IMAGE_WAIT_GRACE_SECONDS = float(os.getenv("IMAGE_WAIT_GRACE_SECONDS", 2))
+
+# "observer" waits for the images with WAIT_FOR_IMAGES_SCRIPT, "poll" uses the old
+# scroll and sleep loop. Kept to compare the wait times of both.
+IMAGE_WAIT_STRATEGY = os.getenv("IMAGE_WAIT_STRATEGY", "observer")
+
+
+def wait_for_images(browser, image_load_threshold):
     start_time = time.time()
 
-    def scroll_until_images_load(browser):
-        while True:
-            # Scroll to the bottom
-            browser.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(0.5)  # Wait for new content to load
+    if IMAGE_WAIT_STRATEGY == "poll":
+        poll_until_images_load(browser, start_time, image_load_threshold)
+        return time.time() - start_time
 
-            images = browser.find_elements(
-                "xpath", '//img[@rel="noreferrer" and contains(@src, "blank.gif")]'
-            )
+    browser.set_script_timeout(image_load_threshold)
+    try:
+        browser.execute_async_script(WAIT_FOR_IMAGES_SCRIPT, IMAGE_WAIT_GRACE_SECONDS)
+    except TimeoutException:
+        # Whatever is still unloaded is reported as an error by selenium_crawl
+        pass
+
+    return time.time() - start_time
+
+
+def poll_until_images_load(browser, start_time, image_load_threshold):
+    while True:
+        # Scroll to the bottom
+        browser.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+        time.sleep(0.5)  # Wait for new content to load
+
+        images = browser.find_elements(
+            "xpath", '//img[@rel="noreferrer" and contains(@src, "blank.gif")]'
+        )
 
-            if not images or (time.time() - start_time >= image_load_threshold):
-                break
+        if not images or (time.time() - start_time >= image_load_threshold):
+            break
 
+
+def selenium_crawl(browser, url, image_load_threshold=120):
+    """
+    Crawls the image links of an issue's reader page.
+
+    Returns:
+        A dictionary with the pages and the seconds spent waiting for lazy loaded
+        images, or a dictionary with an error.
+    """
     browser.get(url)
-    scroll_until_images_load(browser)
+    wait_seconds = wait_for_images(browser, image_load_threshold)
 
-    # Parse page source with BeautifulSoup
-    soup = BeautifulSoup(browser.page_source, "html.parser")
-    images = soup.find_all("img", attrs={"rel": "noreferrer"})
+    # Read the srcs in the browser instead of serializing and re-parsing the whole page
+    sources = browser.execute_script(READ_IMAGE_SOURCES_SCRIPT)
+    if not sources:
+        return {"error": "No reader images found on: " + url}
 
     # Extract img src attributes in order and track index
     result = []
-    for index, img in enumerate(images):
-        src = img.get("src")
+    for index, src in enumerate(sources):
         if not src or "blank.gif" in src:
             return {"error": "Was not able to find src for: " + url}
-        if src:
-            result.append({"page": int(index + 1), "link": src})
+        result.append({"page": int(index + 1), "link": src})
 
-    return result
+    return {
+        "pages": result,
+        "wait_seconds": wait_seconds,
+        "wait_strategy": IMAGE_WAIT_STRATEGY,
+    }
 
 
 if __name__ == "__main__":
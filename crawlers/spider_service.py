@@ -0,0 +1,203 @@
+from multiprocessing import Process, Queue
+from scrapy import signals
+from scrapy.crawler import CrawlerRunner
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor
+import itertools
+import threading
+import atexit
+import queue
+
+
+class CrawlError(Exception):
+    """
+    Raised to the caller when a crawl fails or the crawler process exits.
+    """
+
+
+def serve(requests_queue, results_queue):
+    """
+    Runs in the crawler process. Every crawl request is started on the same reactor,
+    so any number of crawls can run at once, and the scraped items are sent back as
+    soon as they are scraped.
+
+    Messages sent back are (kind, request_id, payload) tuples where kind is "item",
+    "done" or "error". Errors are sent as messages, exceptions may not be picklable.
+    """
+    settings = get_project_settings()
+    settings["LOG_LEVEL"] = "ERROR"
+
+    # Installed here so the reactor only exists in the crawler process
+    if settings.get("TWISTED_REACTOR"):
+        install_reactor(settings["TWISTED_REACTOR"])
+    from twisted.internet import reactor
+
+    runner = CrawlerRunner(settings)
+
+    def start_crawl(request_id, urls, selected_spider, settings, spider_kwargs):
+        def item_scraped(item, response, spider):
+            results_queue.put(("item", request_id, item))
+
+        try:
+            if settings:
+                selected_spider = with_settings(selected_spider, settings)
+            crawler = runner.create_crawler(selected_spider)
+            # weak=False keeps the receiver alive after start_crawl returns
+            crawler.signals.connect(
+                item_scraped, signal=signals.item_scraped, weak=False
+            )
+            deferred = runner.crawl(crawler, urls=urls, **spider_kwargs)
+        except Exception as e:
+            results_queue.put(("error", request_id, str(e)))
+            return
+
+        deferred.addCallbacks(
+            lambda _: results_queue.put(("done", request_id, None)),
+            lambda failure: results_queue.put(
+                ("error", request_id, failure.getErrorMessage())
+            ),
+        )
+
+    def read_requests():
+        while True:
+            request = requests_queue.get()
+            if request is None:
+                reactor.callFromThread(reactor.stop)
+                return
+
+            reactor.callFromThread(start_crawl, *request)
+
+    threading.Thread(target=read_requests, daemon=True).start()
+    reactor.run(installSignalHandlers=False)
+
+
+def with_settings(spider_class, settings):
+    """
+    Returns a subclass of the spider with settings added to its custom_settings, for
+    settings that only apply to one crawl.
+    """
+    custom_settings = {**(spider_class.custom_settings or {}), **settings}
+    return type(
+        spider_class.__name__, (spider_class,), {"custom_settings": custom_settings}
+    )
+
+
+class SpiderService:
+    """
+    Keeps one crawler process running for the lifetime of the API process instead of
+    starting a process and a reactor for every crawl. The process is started on first
+    use and restarted if it dies.
+    """
+
+    def __init__(self):
+        self._process = None
+        self._requests_queue = None
+        self._results_queue = None
+        # (crawler process, results queue) of the crawls waiting for results, by
+        # request id
+        self._pending = {}
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def stream(self, urls, selected_spider, settings=None, **spider_kwargs):
+        """
+        Crawls the urls with the spider and yields every item as soon as it's scraped,
+        so callers can process items while the crawl is still running. settings are
+        Scrapy settings for this crawl only.
+        """
+        results = queue.Queue()
+
+        with self._lock:
+            self._ensure_started()
+            request_id = next(self._request_ids)
+            self._pending[request_id] = (self._process, results)
+            self._requests_queue.put(
+                (request_id, urls, selected_spider, settings, spider_kwargs)
+            )
+
+        try:
+            while True:
+                kind, payload = results.get()
+
+                if kind == "item":
+                    yield payload
+                elif kind == "done":
+                    return
+                else:
+                    raise CrawlError(payload)
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def crawl(self, urls, selected_spider, **spider_kwargs):
+        return list(self.stream(urls, selected_spider, **spider_kwargs))
+
+    def stop(self):
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                self._requests_queue.put(None)
+                self._process.join(timeout=10)
+            self._process = None
+
+    def _ensure_started(self):
+        if self._process is not None and self._process.is_alive():
+            return
+
+        self._requests_queue = Queue()
+        self._results_queue = Queue()
+        self._process = Process(
+            target=serve,
+            args=(self._requests_queue, self._results_queue),
+            daemon=True,
+        )
+        self._process.start()
+
+        threading.Thread(
+            target=self._dispatch_results,
+            args=(self._process, self._results_queue),
+            daemon=True,
+        ).start()
+
+    def _dispatch_results(self, process, results_queue):
+        # Routes results from the crawler process to the crawls waiting for them
+        while True:
+            try:
+                kind, request_id, payload = results_queue.get(timeout=1)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+
+                # Only fail this process' crawls, crawls started after it died run on
+                # the process that replaced it
+                with self._lock:
+                    pending = [
+                        results
+                        for crawl_process, results in self._pending.values()
+                        if crawl_process is process
+                    ]
+                for results in pending:
+                    results.put(("error", "Crawler process exited."))
+                return
+
+            with self._lock:
+                _, results = self._pending.get(request_id, (None, None))
+            if results is not None:
+                results.put((kind, payload))
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_spider_service():
+    """
+    Returns the crawler service shared by all crawls in this process.
+    """
+    global _service
+
+    with _service_lock:
+        if _service is None:
+            _service = SpiderService()
+            atexit.register(_service.stop)
+
+    return _service
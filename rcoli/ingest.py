@@ -0,0 +1,259 @@
+from django.db import connection, transaction
+from django.utils import timezone
+from comics.models import Comic, Issue, Page
+from comics.utils import create_date, natural_sort_key
+from dotenv import load_dotenv
+import time
+import csv
+import io
+import os
+
+load_dotenv()
+
+# Rows per INSERT statement when ingesting issues and pages in bulk
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 1000))
+# Issues with at least this many pages are written with COPY on PostgreSQL
+PAGE_COPY_THRESHOLD = int(os.getenv("PAGE_COPY_THRESHOLD", 500))
+
+
+def crawled_issue_links(issues):
+    """
+    Returns a dictionary mapping the full link of every crawled issue to its title, in
+    the order they were crawled.
+    """
+    crawled = {}
+
+    for issue in issues:
+        issue_title = issue["issue_title"]
+        issue_link = os.getenv("RCOLI_BASE_LINK") + issue["issue_link"]
+
+        if not issue_title or not issue_link:
+            raise ValueError("Issue is missing required fields.")
+
+        crawled[issue_link] = issue_title
+
+    return crawled
+
+
+def add_comic_from_crawl(item):
+    """
+    Creates the comic of a crawled info page and inserts all of its issues in one
+    transaction, so a failure never leaves a half-ingested comic. Issues whose link
+    already exists (listed under another comic) are skipped.
+
+    Returns:
+        The comic and the number of inserted and skipped issues, with the time spent
+        writing them.
+    """
+    title = item.get("title")
+    link = item.get("link")
+    issues = item.get("issues", [])
+
+    if not title or not link:
+        raise ValueError("Missing required fields.")
+
+    crawled = crawled_issue_links(issues)
+
+    start_time = time.perf_counter()
+
+    with transaction.atomic():
+        comic = Comic.objects.create(
+            title=title,
+            link=link,
+            date_published=create_date(item.get("date_published", "")),
+            writers=item.get("writers", ""),
+            artists=item.get("artists", ""),
+            number_issues=len(issues),
+            status=item.get("status", ""),
+            content_hash=item["content_hash"],
+        )
+
+        Issue.objects.bulk_create(
+            [
+                Issue(
+                    title=issue_title,
+                    link=issue_link,
+                    comic_id=comic,
+                    pages=0,
+                    sort_key=natural_sort_key(issue_title),
+                )
+                for issue_link, issue_title in crawled.items()
+            ],
+            batch_size=INGEST_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        # The comic is new, so every issue it has was inserted just now
+        inserted = Issue.objects.filter(comic_id=comic).count()
+
+    seconds = time.perf_counter() - start_time
+
+    return comic, {
+        "inserted": inserted,
+        "skipped": len(issues) - inserted,
+        "seconds": seconds,
+        "rows_per_second": inserted / seconds if seconds else None,
+    }
+
+
+def refresh_comic_issues(comic: Comic, issues):
+    """
+    Brings the comic's issues in line with the crawled issues. The existing issues are
+    loaded in one query and only the difference is written: new issues are inserted,
+    issues with a new title are updated and issues no longer listed are deleted.
+    Page counts of existing issues are kept.
+
+    Deleting an issue deletes its pages and their download job steps, so nothing is
+    deleted when the crawl found no issues at all (most likely a page that didn't
+    parse), and issues used by download jobs are kept.
+
+    Returns:
+        The number of new, skipped (link already used by another comic), changed,
+        removed and kept (no longer listed but used by a download job) issues.
+    """
+    crawled = crawled_issue_links(issues)
+    existing = {issue.link: issue for issue in Issue.objects.filter(comic_id=comic)}
+
+    new_issues = [
+        Issue(
+            title=title,
+            link=link,
+            comic_id=comic,
+            pages=0,
+            sort_key=natural_sort_key(title),
+        )
+        for link, title in crawled.items()
+        if link not in existing
+    ]
+
+    changed_issues = []
+    for link, issue in existing.items():
+        if link in crawled and issue.title != crawled[link]:
+            issue.title = crawled[link]
+            issue.sort_key = natural_sort_key(issue.title)
+            changed_issues.append(issue)
+
+    # A crawl without any issues most likely didn't parse, nothing is removed then
+    delisted_ids = [
+        issue.id for link, issue in existing.items() if crawled and link not in crawled
+    ]
+
+    kept_ids = set(
+        Issue.objects.filter(
+            id__in=delisted_ids, pages_in_issue__download_job_steps__isnull=False
+        ).values_list("id", flat=True)
+    )
+    removed_ids = [issue_id for issue_id in delisted_ids if issue_id not in kept_ids]
+
+    with transaction.atomic():
+        # Links that already belong to another comic are skipped, like in
+        # add_comic_from_crawl
+        Issue.objects.bulk_create(
+            new_issues, batch_size=INGEST_BATCH_SIZE, ignore_conflicts=True
+        )
+        Issue.objects.bulk_update(changed_issues, ["title", "sort_key"])
+        Issue.objects.filter(id__in=removed_ids).delete()
+
+        inserted = Issue.objects.filter(comic_id=comic).count() - (
+            len(existing) - len(removed_ids)
+        )
+
+    return {
+        "new": inserted,
+        "skipped": len(new_issues) - inserted,
+        "changed": len(changed_issues),
+        "removed": len(removed_ids),
+        "kept": len(kept_ids),
+    }
+
+
+def update_comic_from_crawl(item):
+    """
+    Creates or updates the comic of a crawled info page together with its issues, in
+    one transaction. Comics the spider reported as unchanged are only marked as
+    refreshed.
+
+    Returns:
+        The comic and its issue changes, or None as changes when it was unchanged.
+    """
+    now = timezone.now()
+
+    if item.get("unchanged"):
+        comic = Comic.objects.get(link=item["link"])
+        Comic.objects.filter(id=comic.id).update(last_refreshed=now)
+        return comic, None
+
+    title = item.get("title")
+    link = item.get("link")
+    issues = item.get("issues", [])
+
+    if not title or not link:
+        raise ValueError("Missing required fields.")
+
+    fields = {
+        "title": title,
+        "date_published": create_date(item.get("date_published", "")),
+        "writers": item.get("writers", ""),
+        "artists": item.get("artists", ""),
+        "status": item.get("status", ""),
+        "number_issues": len(issues),
+        "content_hash": item["content_hash"],
+        "last_refreshed": now,
+    }
+
+    # The comic and its issues are refreshed together or not at all
+    with transaction.atomic():
+        comic, _ = Comic.objects.update_or_create(link=link, defaults=fields)
+        changes = refresh_comic_issues(comic, issues)
+
+    return comic, changes
+
+
+def replace_issue_pages(issue: Issue, pages):
+    """
+    Replaces the issue's pages with the crawled pages and updates its page count in one
+    transaction. Readers see either the old pages or the new ones, never an issue with
+    no pages.
+    """
+    with transaction.atomic():
+        Page.objects.filter(issue_id=issue).delete()
+
+        if connection.vendor == "postgresql" and len(pages) >= PAGE_COPY_THRESHOLD:
+            copy_pages(issue, pages)
+        else:
+            Page.objects.bulk_create(
+                [
+                    Page(
+                        issue_id=issue,
+                        page_number=page["page"],
+                        title=issue.title,
+                        image_link=page["link"],
+                    )
+                    for page in pages
+                ],
+                batch_size=INGEST_BATCH_SIZE,
+            )
+
+        issue.pages = len(pages)
+        issue.save(update_fields=["pages"])
+
+
+def copy_pages(issue: Issue, pages):
+    # COPY streams every row in one statement, much faster than INSERTs for big batches
+    rows = io.StringIO()
+    writer = csv.writer(rows)
+    for page in pages:
+        writer.writerow([issue.id, page["page"], issue.title, page["link"]])
+    rows.seek(0)
+
+    quote_name = connection.ops.quote_name
+    columns = ", ".join(
+        quote_name(Page._meta.get_field(name).column)
+        for name in ("issue_id", "page_number", "title", "image_link")
+    )
+
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {quote_name(Page._meta.db_table)} ({columns}) "
+            "FROM STDIN WITH (FORMAT csv)",
+            rows,
+        )
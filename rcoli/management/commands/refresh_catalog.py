@@ -0,0 +1,45 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from rcoli.scheduler import (
+    refresh_catalog,
+    REFRESH_BATCH_SIZE,
+    REFRESH_CONCURRENCY,
+    REFRESH_PAGES_PER_MINUTE,
+)
+
+
+class Command(BaseCommand):
+    help = "Refreshes the comics in the catalog, ongoing and least recently tried first. Run it from a scheduler such as cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-hours",
+            type=float,
+            help="Only refresh comics not tried in this many hours.",
+        )
+        parser.add_argument(
+            "--limit", type=int, help="Refresh at most this many comics."
+        )
+        parser.add_argument("--batch-size", type=int, default=REFRESH_BATCH_SIZE)
+        parser.add_argument(
+            "--pages-per-minute", type=float, default=REFRESH_PAGES_PER_MINUTE
+        )
+        parser.add_argument("--concurrency", type=int, default=REFRESH_CONCURRENCY)
+
+    def handle(self, *args, **options):
+        older_than = None
+        if options["older_than_hours"] is not None:
+            older_than = timedelta(hours=options["older_than_hours"])
+
+        summary = refresh_catalog(
+            older_than=older_than,
+            limit=options["limit"],
+            batch_size=options["batch_size"],
+            pages_per_minute=options["pages_per_minute"],
+            concurrency=options["concurrency"],
+        )
+
+        self.stdout.write(
+            f"Refreshed catalog: {summary['updated']} updated, "
+            f"{summary['unchanged']} unchanged, {summary['failed']} failed"
+        )
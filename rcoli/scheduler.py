@@ -0,0 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Q, When
+from django.utils import timezone
+from comics.models import Comic, ComicRefresh
+from crawlers.rcoli import stream_spider, InfoPageSpider
+from crawlers.spider_service import CrawlError
+from .ingest import update_comic_from_crawl
+from dotenv import load_dotenv
+import threading
+import time
+import os
+
+load_dotenv()
+
+# Number of info pages sent to the crawler in one crawl
+REFRESH_BATCH_SIZE = int(os.getenv("REFRESH_BATCH_SIZE", 10))
+# Info pages requested from the source per minute, across all batches
+REFRESH_PAGES_PER_MINUTE = float(os.getenv("REFRESH_PAGES_PER_MINUTE", 30))
+# Batches crawling at the same time
+REFRESH_CONCURRENCY = int(os.getenv("REFRESH_CONCURRENCY", 2))
+
+
+class RateLimiter:
+    """
+    Spaces out info page requests so no more than pages_per_minute are started per
+    minute. Every page of a batch gets its own start time, interval seconds apart.
+    wait() returns at the first one, the crawl then has to request the pages interval
+    seconds apart itself, see refresh_batch.
+    """
+
+    def __init__(self, pages_per_minute):
+        self.interval = 60 / pages_per_minute
+        self._next_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self, pages):
+        with self._lock:
+            start = max(self._next_start, time.monotonic())
+            self._next_start = start + pages * self.interval
+
+        time.sleep(max(0, start - time.monotonic()))
+
+
+def comics_to_refresh(older_than=None, limit=None):
+    """
+    Returns the comics in the order they should be refreshed: ongoing series before
+    completed ones, then the ones tried longest ago (never tried first). Failed
+    refreshes count as tried, so comics that keep failing don't hold up the rest.
+    """
+    comics = Comic.objects.annotate(
+        completed=Case(
+            When(status__iexact="completed", then=1),
+            default=0,
+            output_field=IntegerField(),
+        )
+    ).order_by(
+        "completed", F("refresh_attempted_at").asc(nulls_first=True), "last_updated"
+    )
+
+    if older_than is not None:
+        cutoff = timezone.now() - older_than
+        comics = comics.filter(
+            Q(refresh_attempted_at__isnull=True) | Q(refresh_attempted_at__lt=cutoff)
+        )
+
+    if limit:
+        comics = comics[:limit]
+
+    return comics
+
+
+def refresh_catalog(
+    older_than=None,
+    limit=None,
+    batch_size=REFRESH_BATCH_SIZE,
+    pages_per_minute=REFRESH_PAGES_PER_MINUTE,
+    concurrency=REFRESH_CONCURRENCY,
+):
+    """
+    Refreshes the catalog in batches of batch_size comics, with at most concurrency
+    batches crawling at once and pages_per_minute pages requested from the source.
+    The result for every comic is stored as a ComicRefresh.
+
+    Returns:
+        The number of comics per refresh status.
+    """
+    comics = list(
+        comics_to_refresh(older_than, limit).values_list("id", "link", "content_hash")
+    )
+    batches = [
+        comics[index : index + batch_size]
+        for index in range(0, len(comics), batch_size)
+    ]
+    rate_limiter = RateLimiter(pages_per_minute)
+
+    def refresh(batch):
+        try:
+            rate_limiter.wait(len(batch))
+            return refresh_batch(batch, page_interval=rate_limiter.interval)
+        finally:
+            # Each thread gets its own connection, close it before the thread exits
+            connection.close()
+
+    summary = {"updated": 0, "unchanged": 0, "failed": 0}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for statuses in executor.map(refresh, batches):
+            for status in statuses:
+                summary[status] += 1
+
+    return summary
+
+
+def refresh_batch(batch, page_interval=0):
+    """
+    Crawls and ingests a batch of (id, link, content_hash) comics, requesting the info
+    pages page_interval seconds apart.
+    """
+    started_at = timezone.now()
+    comic_ids = {link: comic_id for comic_id, link, _ in batch}
+    known_hashes = {
+        link: content_hash for _, link, content_hash in batch if content_hash
+    }
+
+    refreshes = {}
+    error = "Info page was not crawled."
+
+    # Each comic is ingested as soon as its info page is scraped
+    try:
+        for item in stream_spider(
+            list(comic_ids),
+            InfoPageSpider,
+            known_hashes=known_hashes,
+            # No jitter, a shorter delay than page_interval would exceed the rate
+            settings={"DOWNLOAD_DELAY": page_interval, "DOWNLOAD_DELAY_JITTER": 0},
+        ):
+            comic_id = comic_ids.get(item.get("link"))
+            if comic_id is None:
+                # Redirected to a different link, nothing to attribute the result to
+                continue
+
+            refresh = ComicRefresh(comic_id=comic_id, started_at=started_at)
+            try:
+                _, changes = update_comic_from_crawl(item)
+            except Exception as e:
+                refresh.status = "failed"
+                refresh.error = str(e)
+            else:
+                if changes is None:
+                    refresh.status = "unchanged"
+                else:
+                    refresh.status = "updated"
+                    refresh.new_issues = changes["new"]
+                    refresh.changed_issues = changes["changed"]
+                    refresh.removed_issues = changes["removed"]
+
+            refresh.finished_at = timezone.now()
+            refreshes[comic_id] = refresh
+    except CrawlError as e:
+        error = str(e)
+
+    for comic_id in comic_ids.values():
+        if comic_id not in refreshes:
+            refreshes[comic_id] = ComicRefresh(
+                comic_id=comic_id,
+                started_at=started_at,
+                finished_at=timezone.now(),
+                status="failed",
+                error=error,
+            )
+
+    ComicRefresh.objects.bulk_create(refreshes.values())
+    Comic.objects.filter(id__in=comic_ids.values()).update(
+        refresh_attempted_at=timezone.now()
+    )
+
+    return [refresh.status for refresh in refreshes.values()]
@@ -0,0 +1,223 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+from django.test import SimpleTestCase, TestCase
+from comics.models import Comic, Issue, Page, DownloadJob, DownloadJobStep
+from crawlers.rcoli import InfoPageSpider
+from crawlers.spider_service import SpiderService
+from rcoli.ingest import refresh_comic_issues
+import threading
+import tempfile
+import time
+import os
+
+FIXTURES_FOLDER = Path(__file__).resolve().parent.parent / "benchmarks" / "fixtures"
+
+
+class NoValidatorsHandler(BaseHTTPRequestHandler):
+    # Serves the info page fixture without ETag, Last-Modified, Expires or Date
+    requests = 0
+    requested_at = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_header(self, keyword, value):
+        if keyword not in ("Date", "Server"):
+            super().send_header(keyword, value)
+
+    def do_GET(self):
+        type(self).requests += 1
+        self.requested_at.append(time.monotonic())
+        body = (FIXTURES_FOLDER / "info_page.html").read_bytes()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class InfoPageCrawlTests(SimpleTestCase):
+    def setUp(self):
+        handler = type(
+            "Handler", (NoValidatorsHandler,), {"requests": 0, "requested_at": []}
+        )
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.handler = handler
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+
+    def crawl(self, urls, ttl, **kwargs):
+        # The crawler process is forked with the patched settings
+        service = SpiderService()
+        try:
+            with mock.patch.dict(
+                "crawlers.crawl_cache.CRAWL_CACHE_SETTINGS",
+                {"HTTPCACHE_DIR": self.cache_dir},
+            ), mock.patch("crawlers.crawl_cache.CRAWL_CACHE_TTL", ttl):
+                return service.crawl(urls, InfoPageSpider, **kwargs)
+        finally:
+            service.stop()
+
+    def test_caches_pages_without_validators_for_the_ttl(self):
+        url = f"http://127.0.0.1:{self.server.server_port}/Comic/Example"
+
+        first = self.crawl([url], ttl=3600)
+        second = self.crawl([url], ttl=3600)
+
+        self.assertEqual(self.handler.requests, 1)
+        self.assertEqual(first[0]["content_hash"], second[0]["content_hash"])
+
+    def test_fetches_pages_without_validators_again_after_the_ttl(self):
+        url = f"http://127.0.0.1:{self.server.server_port}/Comic/Example"
+
+        self.crawl([url], ttl=0)
+        self.crawl([url], ttl=0)
+
+        self.assertEqual(self.handler.requests, 2)
+
+    def test_crawl_settings_space_out_requests(self):
+        urls = [
+            f"http://127.0.0.1:{self.server.server_port}/Comic/Example-{index}"
+            for index in range(3)
+        ]
+
+        self.crawl(
+            urls,
+            ttl=0,
+            settings={"DOWNLOAD_DELAY": 0.3, "DOWNLOAD_DELAY_JITTER": 0},
+        )
+
+        requested_at = self.handler.requested_at
+        self.assertEqual(len(requested_at), 3)
+        for earlier, later in zip(requested_at, requested_at[1:]):
+            self.assertGreaterEqual(later - earlier, 0.25)
+
+
+BASE_LINK = "https://example.com"
+
+
+def crawled_issues(*numbers, title="Issue"):
+    return [
+        {
+            "issue_title": f"{title} #{number}",
+            "issue_link": f"/Comic/Example/Issue-{number}",
+        }
+        for number in numbers
+    ]
+
+
+@mock.patch.dict(os.environ, {"RCOLI_BASE_LINK": BASE_LINK})
+class RefreshComicIssuesTests(TestCase):
+    def setUp(self):
+        self.comic = self.create_comic("Example")
+        for number in (1, 2):
+            self.create_issue(self.comic, number)
+
+    def create_comic(self, name):
+        return Comic.objects.create(
+            title=name,
+            link=f"{BASE_LINK}/Comic/{name}",
+            date_published="2000-01-01",
+            writers="",
+            artists="",
+            number_issues=0,
+        )
+
+    def create_issue(self, comic, number):
+        issue = Issue.objects.create(
+            title=f"Issue #{number}",
+            link=f"{BASE_LINK}/Comic/Example/Issue-{number}",
+            comic_id=comic,
+            pages=1,
+        )
+        Page.objects.create(
+            issue_id=issue,
+            page_number=1,
+            title=issue.title,
+            image_link=f"{issue.link}/1.jpg",
+        )
+        return issue
+
+    def issue_titles(self, comic=None):
+        return sorted(
+            Issue.objects.filter(comic_id=comic or self.comic).values_list(
+                "title", flat=True
+            )
+        )
+
+    def test_adds_new_issues(self):
+        changes = refresh_comic_issues(self.comic, crawled_issues(1, 2, 3))
+
+        self.assertEqual(changes["new"], 1)
+        self.assertEqual(self.issue_titles(), ["Issue #1", "Issue #2", "Issue #3"])
+
+    def test_updates_changed_titles(self):
+        changes = refresh_comic_issues(
+            self.comic, crawled_issues(1) + crawled_issues(2, title="Renamed")
+        )
+
+        self.assertEqual(changes["changed"], 1)
+        self.assertEqual(self.issue_titles(), ["Issue #1", "Renamed #2"])
+        # Existing issues keep their pages
+        self.assertEqual(Page.objects.count(), 2)
+
+    def test_removes_delisted_issues_with_their_pages(self):
+        changes = refresh_comic_issues(self.comic, crawled_issues(1))
+
+        self.assertEqual(changes["removed"], 1)
+        self.assertEqual(self.issue_titles(), ["Issue #1"])
+        self.assertEqual(Page.objects.count(), 1)
+
+    def test_keeps_delisted_issues_used_by_download_jobs(self):
+        page = Page.objects.get(issue_id__title="Issue #2")
+        job = DownloadJob.objects.create(
+            downloaded_pages=0,
+            total_pages=1,
+            total_issues=1,
+            complete=False,
+            name="job",
+        )
+        DownloadJobStep.objects.create(
+            download_job=job,
+            page=page,
+            image_link=page.image_link,
+            page_number=1,
+            issue_index_number=0,
+            complete=False,
+            issue_link=page.issue_id.link,
+            retry=False,
+        )
+
+        changes = refresh_comic_issues(self.comic, crawled_issues(1))
+
+        self.assertEqual((changes["removed"], changes["kept"]), (0, 1))
+        self.assertEqual(self.issue_titles(), ["Issue #1", "Issue #2"])
+        self.assertEqual(DownloadJobStep.objects.count(), 1)
+
+    def test_removes_nothing_when_the_crawl_has_no_issues(self):
+        changes = refresh_comic_issues(self.comic, [])
+
+        self.assertEqual(changes["removed"], 0)
+        self.assertEqual(self.issue_titles(), ["Issue #1", "Issue #2"])
+
+    def test_skips_links_owned_by_another_comic(self):
+        other_comic = self.create_comic("Other")
+        Issue.objects.create(
+            title="Other #3",
+            link=f"{BASE_LINK}/Comic/Example/Issue-3",
+            comic_id=other_comic,
+            pages=0,
+        )
+
+        changes = refresh_comic_issues(self.comic, crawled_issues(1, 2, 3, 4))
+
+        self.assertEqual((changes["new"], changes["skipped"]), (1, 1))
+        self.assertEqual(self.issue_titles(), ["Issue #1", "Issue #2", "Issue #4"])
+        self.assertEqual(self.issue_titles(other_comic), ["Other #3"])
@@ -6,4 +6,5 @@ urlpatterns = [
     path("add_or_update_comic_and_issues", views.add_or_update_comics_and_issues),
     path("add_pages", views.add_pages),
     path("add_pages_missing_issues", views.add_pages_missing_issues),
+    path("get_crawl_stats", views.get_crawl_stats),
 ]
@@ -2,12 +2,13 @@ from django.http import JsonResponse
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from comics.utils import *
-from comics.models import Comic, Issue, Page
-from crawlers.rcoli import run_spider, InfoPageSpider, crawl_issues
+from comics.models import Comic, Issue
+from crawlers.rcoli import stream_spider, InfoPageSpider, crawl_issues, crawl_stats
+from crawlers.spider_service import CrawlError
 from django.shortcuts import get_object_or_404
+from .ingest import add_comic_from_crawl, update_comic_from_crawl, replace_issue_pages
 
 from dotenv import load_dotenv
-import os
 
 load_dotenv()
 
@@ -17,62 +18,27 @@ def add_comics_and_issues(request):
     # Ensure the request has valid data (title, link, etc.)
     data = request.data
     urls = data["urls"]
-    try:
-        comics = run_spider(urls, InfoPageSpider)
-    except Exception as e:
-        # If there was an error with the request, send an error response
-        return Response({"error": str(e)}, status=500)
-
     result = []
 
-    for comic in comics:
-        try:
-            title = comic["title"]
-            link = comic["link"]
-            writers = comic["writers"]
-            artists = comic["artists"]
-            date_published = comic["date_published"]
-            issues = comic["issues"]
-            number_issues = len(issues)
-            # Check that required fields are present
-            if not title or not link:
-                return Response({"error": "Missing required fields."}, status=400)
-
-            # Create and save the new comic
-            created_comic = Comic.objects.create(
-                title=title,
-                link=link,
-                date_published=create_date(date_published),
-                writers=writers,
-                artists=artists,
-                number_issues=number_issues,
-            )
-        except Exception as e:
-            return Response({"error": str(e)}, status=403)
-
-        print("comic created")
-
-        for issue in issues:
+    # Comics are written as soon as they're scraped, while the rest are still crawled
+    try:
+        for comic in stream_spider(urls, InfoPageSpider):
             try:
-                issue_title = issue["issue_title"]
-                issue_link = os.getenv("RCOLI_BASE_LINK") + issue["issue_link"]
-                pages = 0
-
-                if not issue_title or not issue_link:
-                    return Response(
-                        {"error": "Issue is missing required fields."}, status=400
-                    )
-
-                Issue.objects.create(
-                    title=issue_title,
-                    link=issue_link,
-                    comic_id=created_comic,
-                    pages=pages,
-                )
+                created_comic, ingested = add_comic_from_crawl(comic)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
             except Exception as e:
-                print(issue.link, issue.title)
+                return Response({"error": str(e)}, status=403)
+
+            print(
+                f"comic created: {ingested['inserted']} issues inserted, "
+                f"{ingested['skipped']} skipped in {ingested['seconds']:.3f}s"
+            )
 
-        result.append(comic_to_json(created_comic))
+            result.append({**comic_to_json(created_comic), "issue_ingest": ingested})
+    except CrawlError as e:
+        # If there was an error with the request, send an error response
+        return Response({"error": str(e)}, status=500)
 
     return Response(result)
 
@@ -82,78 +48,32 @@ def add_or_update_comics_and_issues(request):
     data = request.data
     urls = data["urls"]
 
-    try:
-        comics = run_spider(urls, InfoPageSpider)
-    except Exception as e:
-        return Response({"error": str(e)}, status=500)
+    # Pages that still hash the same as when they were ingested are skipped
+    known_hashes = dict(
+        Comic.objects.filter(link__in=urls)
+        .exclude(content_hash="")
+        .values_list("link", "content_hash")
+    )
 
     result = []
 
-    for comic in comics:
-        try:
-            title = comic["title"]
-            link = comic["link"]
-            writers = comic.get("writers", "")
-            artists = comic.get("artists", "")
-            date_published = comic.get("date_published", "")
-            issues = comic.get("issues", [])
-            number_issues = len(issues)
-
-            if not title or not link:
-                return Response({"error": "Missing required fields."}, status=400)
-
-            # Check if the comic already exists
-            existing_comic = Comic.objects.filter(link=link).first()
-
-            if existing_comic:
-                # Update the existing comic
-                existing_comic.title = title
-                existing_comic.writers = writers
-                existing_comic.artists = artists
-                existing_comic.date_published = create_date(date_published)
-                existing_comic.number_issues = number_issues
-                existing_comic.save()
+    try:
+        for comic in stream_spider(urls, InfoPageSpider, known_hashes=known_hashes):
+            try:
+                updated_comic, changes = update_comic_from_crawl(comic)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
+            except Exception as e:
+                return Response({"error": str(e)}, status=403)
+
+            if changes is None:
+                result.append({**comic_to_json(updated_comic), "unchanged": True})
             else:
-                # Create a new comic
-                existing_comic = Comic.objects.create(
-                    title=title,
-                    link=link,
-                    date_published=create_date(date_published),
-                    writers=writers,
-                    artists=artists,
-                    number_issues=number_issues,
+                result.append(
+                    {**comic_to_json(updated_comic), "issue_changes": changes}
                 )
-
-            for issue in issues:
-                issue_title = issue["issue_title"]
-                issue_link = os.getenv("RCOLI_BASE_LINK") + issue["issue_link"]
-                pages = 0
-
-                if not issue_title or not issue_link:
-                    return Response(
-                        {"error": "Issue is missing required fields."}, status=400
-                    )
-
-                # Check if the issue already exists
-                existing_issue = Issue.objects.filter(
-                    link=issue_link, comic_id=existing_comic
-                ).first()
-
-                if existing_issue:
-                    existing_issue.title = issue_title
-                    existing_issue.pages = pages
-                    existing_issue.save()
-                else:
-                    Issue.objects.create(
-                        title=issue_title,
-                        link=issue_link,
-                        comic_id=existing_comic,
-                        pages=pages,
-                    )
-
-            result.append(comic_to_json(existing_comic))
-        except Exception as e:
-            return Response({"error": str(e)}, status=403)
+    except CrawlError as e:
+        return Response({"error": str(e)}, status=500)
 
     return Response(result)
 
@@ -174,33 +94,11 @@ def process_add_pages_for_issues(issue_requests):
 
     successes, failures = crawl_issues(workload)
 
-    for success in successes:
-
-        issue_id = success["issue_id"]
-        pages = success["pages"]
-        num_pages = len(pages)
-
-        issue = Issue.objects.get(id=issue_id)
+    issues = Issue.objects.in_bulk([success["issue_id"] for success in successes])
 
-        # update number of pages
-        issue.pages = num_pages
+    for success in successes:
         try:
-            issue.save()
-
-            # delete all existing pages with the issue id
-            Page.objects.filter(issue_id=issue_id).delete()
-
-            for page in pages:
-                page_number = page["page"]
-                image_link = page["link"]
-                title = issue.title
-
-                Page.objects.create(
-                    issue_id=issue,
-                    page_number=page_number,
-                    title=title,
-                    image_link=image_link,
-                )
+            replace_issue_pages(issues[success["issue_id"]], success["pages"])
         except Exception as e:
             print(e)
             failures.append({"issue_id": success["issue_id"], "link": success["link"]})
@@ -218,7 +116,13 @@ def add_pages(request):
     return Response(
         {
             "successes": [
-                {"issue_id": cur_issue["issue_id"], "link": cur_issue["link"]}
+                {
+                    "issue_id": cur_issue["issue_id"],
+                    "link": cur_issue["link"],
+                    "crawl_path": cur_issue["crawl_path"],
+                    "wait_seconds": cur_issue["wait_seconds"],
+                    "wait_strategy": cur_issue["wait_strategy"],
+                }
                 for cur_issue in successes
             ],
             "failures": [
@@ -248,7 +152,13 @@ def add_pages_missing_issues(request):
     return Response(
         {
             "successes": [
-                {"issue_id": cur_issue["issue_id"], "link": cur_issue["link"]}
+                {
+                    "issue_id": cur_issue["issue_id"],
+                    "link": cur_issue["link"],
+                    "crawl_path": cur_issue["crawl_path"],
+                    "wait_seconds": cur_issue["wait_seconds"],
+                    "wait_strategy": cur_issue["wait_strategy"],
+                }
                 for cur_issue in successes
             ],
             "failures": [
@@ -257,3 +167,8 @@ def add_pages_missing_issues(request):
             ],
         }
     )
+
+
+@api_view(["GET"])
+def get_crawl_stats(request):
+    return Response(crawl_stats())